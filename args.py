@@ -7,5 +7,14 @@ def getarparser():
 	parser.add_argument('--min_hits', type=int,  default=3,  help='minimum hits before state tracker will be CONFIRMED')
 	parser.add_argument('--max_age',  type=int,  default=10, help='maximum predictes without updates')
 	parser.add_argument('--tracker_name', type=str, default='kcf', choices=['csrt', 'kcf', 'mil'])
+	parser.add_argument('--tracker_process', action='store_true', help='run the OpenCV tracker in a child process')
+	parser.add_argument('--search_window', action='store_true', help='hand the tracker a window around the predicted bbox instead of the whole frame')
+	parser.add_argument('--multi_target', action='store_true', help='select several targets, the one followed can be switched between them')
+	parser.add_argument('--pyramid_budget', type=int, default=0, help='bbox area in pixels the tracker works with, frames are downscaled to fit it; 0 to track at full resolution')
+	parser.add_argument('--compensate_latency', action='store_true', help='control on the target position predicted for the time commands reach the vehicle')
 	parser.add_argument('--pid_input', type=str, default='pixels', choices=['pixels', 'angles'])
+	parser.add_argument('--decode_profile', type=str, default='full', choices=['full', 'half', 'quarter', 'gray', 'gray_half', 'gray_quarter'])
+	parser.add_argument('--decode_workers', type=int, default=0, help='number of decoding processes, 0 to decode in-process')
+	parser.add_argument('--rc_rate', type=float, default=50.0, help='RC keepalive rate, Hz')
+	parser.add_argument('--record', type=str, default=None, help='path to record the video stream to, see video_record')
 	return parser
\ No newline at end of file
@@ -3,20 +3,46 @@
 
 import numpy as np
 import math
-from tracker_propagation import TrackerPropagation, TRACKER_STATES
-from PyQt5.QtCore import QObject
-from PyQt5.QtWidgets import QApplication
+from tracker_propagation import TrackerPropagation, MultiTrackerPropagation, TRACKER_STATES
 import cv2
-import sys
+import time
 from args import getarparser
+from pioneer_sdk import VideoFrame
+from decode_pool import DecodePool
+
+
+DECODE_PROFILES = {  # name: (cv2.imdecode flag, downscale factor)
+	'full': (cv2.IMREAD_COLOR, 1),
+	'half': (cv2.IMREAD_REDUCED_COLOR_2, 2),
+	'quarter': (cv2.IMREAD_REDUCED_COLOR_4, 4),
+	'gray': (cv2.IMREAD_GRAYSCALE, 1),
+	'gray_half': (cv2.IMREAD_REDUCED_GRAYSCALE_2, 2),
+	'gray_quarter': (cv2.IMREAD_REDUCED_GRAYSCALE_4, 4),
+}
+
+DECODE_TIMEOUT = 1.  # Seconds a frame is waited for from the decoding processes
 
 
 class Camera:
 
-	def __init__(self, get_raw_frame_cb):
+	def __init__(self, get_raw_frame_cb, decode_profile='full', decode_workers=0):
+		"""
+		:param get_raw_frame_cb: returns either a JPEG frame or a VideoFrame record
+		:param decode_profile: one of DECODE_PROFILES. Reduced profiles decode to a smaller image, tracking is done
+		on it, but bboxes returned by `track` are in full frame coordinates
+		:param decode_workers: number of decoding processes, see decode_pool. Decoding is done in-process if 0.
+		Frames are kept in flight for every worker, so the frames returned lag behind the received ones by
+		`decode_workers - 1`
+		"""
 		self.get_raw_frame = get_raw_frame_cb
 		self.tracker = None
-		self.app = QApplication(sys.argv)
+		self.target = 0  # Index of the target followed, if the tracker follows several
+		self.bboxes = None  # Bboxes of all the targets, in full frame coordinates
+		self.states = None
+		self.n_frames = 0
+		self.decode_flag, self.scale = DECODE_PROFILES[decode_profile]
+		self.decode_workers = decode_workers
+		self.decode_pool = None
 
 	def purge_buffer(self, n_iterations):
 		for _ in range(0, n_iterations):
@@ -27,31 +53,135 @@ class Camera:
 		if img is None:
 			return False
 
+		# The trackers take their state to be for the time they are created at, after the selection, which may well
+		# take longer than the time their Kalman filters predict over at once
+		opts = getarparser().parse_args()
+		if opts.multi_target:
+			rois = cv2.selectROIs(window_name, img)
+			cv2.waitKey(1)
+			if len(rois) == 0:
+				return False
+			self.tracker = MultiTrackerPropagation(img, np.array(rois), opts, process=opts.tracker_process)
+			self.target = 0
+			return True
+
 		roi = cv2.selectROI(window_name, img)
 		cv2.waitKey(1)
 
-		self.tracker = TrackerPropagation(img, np.array(roi), getarparser().parse_args())
+		self.tracker = TrackerPropagation(img, np.array(roi), opts, process=opts.tracker_process,
+			search_window=opts.search_window, pyramid_budget=opts.pyramid_budget or None)
 
 		return True
 
 	def track(self, *args, **kwargs):
-		return self.tracker.track(*args, **kwargs)
+		"""
+		:return: bbox in full frame coordinates, tracker state. Of the target followed, if there are several
+		"""
+		bbox, state = self.tracker.track(*args, **kwargs)
+		if isinstance(self.tracker, MultiTrackerPropagation):
+			self.bboxes, self.states = bbox * self.scale, state
+			return self.bboxes[self.target], self.states[self.target]
+		return bbox * self.scale, state
+
+	def predict_at(self, t):
+		"""
+		:param t: time.monotonic()
+		:return: bbox predicted for `t`, in full frame coordinates. Of the target followed, if there are several
+		"""
+		bbox = self.tracker.predict_at(t)
+		if isinstance(self.tracker, MultiTrackerPropagation):
+			bbox = bbox[self.target]
+		return bbox * self.scale
+
+	def switch_target(self):
+		"""
+		Follows the next target which has not been lost, if the tracker follows several
+		:return: whether another target is followed
+		"""
+		if self.states is None:
+			return False
+		for i in range(1, len(self.states)):
+			target = (self.target + i) % len(self.states)
+			if self.states[target] != TRACKER_STATES.STATE_DELETED:
+				self.target = target
+				return True
+		return False
+
+	def decoys(self):
+		"""
+		:return: bboxes of the confirmed targets other than the one followed, in full frame coordinates
+		"""
+		if self.states is None:
+			return []
+		return [bbox for i, (bbox, state) in enumerate(zip(self.bboxes, self.states))
+			if i != self.target and state == TRACKER_STATES.STATE_CONFIRMED]
 
 	def get_frame(self):
 		"""
 		:return: None, if failed to get one. cv2 frame on success
 		"""
+		frame = self.get_frame_record()
+		return frame.img if frame is not None else None
+
+	def close(self):
+		if self.tracker is not None:
+			self.tracker.stop()
+		if self.decode_pool is not None:
+			self.decode_pool.close()
+			self.decode_pool = None
+
+	def get_frame_record(self):
+		"""
+		:return: None, if failed to get one. VideoFrame with the decoded cv2 frame in `img` on success
+		"""
 		try:
-			img = self.get_raw_frame()
-			if img is None:
+			frame = self._get_raw_frame_record()
+			if frame is None:
 				return None
 
-			img = cv2.imdecode(np.frombuffer(img, dtype=np.uint8), cv2.IMREAD_COLOR)
-
-			return img
+			if self.decode_workers == 0:
+				return self._decode(frame)
+
+			if self.decode_pool is None:
+				# The first frame is decoded in-process, its shape is what the pool's frame slots are sized for
+				frame = self._decode(frame)
+				if frame is not None:
+					self.decode_pool = DecodePool(frame.img.shape, self.decode_flag, self.decode_workers)
+				return frame
+
+			self.decode_pool.submit(frame)
+			while self.decode_pool.queue_depth < self.decode_workers:  # Keep every worker busy
+				frame = self._get_raw_frame_record()
+				if frame is None:
+					break
+				self.decode_pool.submit(frame)
+			try:
+				return self.decode_pool.get(DECODE_TIMEOUT)
+			except RuntimeError:  # A worker has died along with the frames it had, start over with a new pool
+				self.decode_pool.close()
+				self.decode_pool = None
+				return None
 		except:
 			return None
 
+	def _get_raw_frame_record(self):
+		frame = self.get_raw_frame()
+		if frame is None:
+			return None
+		self.n_frames += 1
+		if not isinstance(frame, VideoFrame):
+			frame = VideoFrame(frame, self.n_frames)
+		return frame
+
+	def _decode(self, frame):
+		time_start = time.monotonic()
+		frame.img = cv2.imdecode(np.frombuffer(frame.data, dtype=np.uint8), self.decode_flag)
+		frame.decode_duration = time.monotonic() - time_start
+		if frame.img is None:
+			return None
+
+		return frame
+
 	@staticmethod
 	def _center_positions(bbox, frame_sz, fov, normalize=True):
 
@@ -75,10 +205,13 @@ class Camera:
 		return positions
 
 	@staticmethod
-	def center_positions(bbox, img, normalize=True, type=None):
+	def center_positions(bbox, img, normalize=True, type=None, scale=1):
+		"""
+		:param scale: downscale factor `img` has been decoded with, see DECODE_PROFILES
+		"""
 		assert type in ['angles', 'pixels', None]
 
-		frame_sz = (img.shape[1], img.shape[0])
+		frame_sz = (img.shape[1] * scale, img.shape[0] * scale)
 		fov = 2.*math.atan2(max(frame_sz), max(frame_sz)*1.5)
 
 		pos = Camera._center_positions(bbox, frame_sz, fov, normalize)
@@ -91,14 +224,27 @@ class Camera:
 		return pos
 
 	@staticmethod
-	def visualize_tracking(img, bbox, state, window_name):
+	def visualize_tracking(img, bbox, state, window_name, scale=1, text=None, decoys=()):
+		"""
+		:param scale: downscale factor `img` has been decoded with, `bbox` is in full frame coordinates
+		:param text: status line to show at the bottom of the frame
+		:param decoys: bboxes of the other targets, see `decoys`
+		"""
+		for decoy in decoys:
+			x1, y1, w, h = np.asarray(decoy) / scale
+			cv2.rectangle(img, (int(x1), int(y1)), (int(x1 + w), int(y1 + h)), (128, 128, 128), 1)
+
 		if state == TRACKER_STATES.STATE_CONFIRMED:
-			x1, y1, w, h = bbox
+			x1, y1, w, h = np.asarray(bbox) / scale
 			cv2.rectangle(img, (int(x1), int(y1)), (int(x1 + w), int(y1 + h)), (0, 255, 0), 2)
 
 		if state == TRACKER_STATES.STATE_DELETED:
 			cv2.putText(img, 'OBJECT LOST', (20, 20), cv2.FONT_HERSHEY_SIMPLEX,
 						1, (255, 0, 255), 2, cv2.LINE_AA)
 
+		if text is not None:
+			cv2.putText(img, text, (10, img.shape[0] - 10), cv2.FONT_HERSHEY_SIMPLEX,
+						0.4, (255, 255, 255), 1, cv2.LINE_AA)
+
 		cv2.imshow(window_name, img)
 		cv2.waitKey(1)
@@ -3,6 +3,8 @@ import pioneer_sdk
 import time
 import math
 from threedvector import Vector
+from metrics import RollingStatistics
+import threading
 import debug
 
 
@@ -12,7 +14,10 @@ def clamp(val, min_value, max_value):
 
 class RcWrapper(pioneer_sdk.Pioneer):
 
-	def __init__(self, *args, **kwargs):
+	def __init__(self, *args, rc_rate=50.0, **kwargs):
+		"""
+		@param rc_rate:  -  number of times a second RC channels are sent by `push_rc_task` when they do not change
+		"""
 		pioneer_sdk.Pioneer.__init__(self, *args, **kwargs)
 		self.control = {
 			"roll": 0.0,
@@ -21,6 +26,12 @@ class RcWrapper(pioneer_sdk.Pioneer):
 			"throttle": 0.0,
 			"mode": 2
 		}
+		self.rc_rate = rc_rate
+		self.rc_changed = threading.Event()  # Wakes `push_rc_task` up to send a new value right away
+		self.rc_lock = threading.Lock()  # Keeps `push_rc` from sending channels updated together half-updated
+		self.rc_period = RollingStatistics()  # Time between keepalives, seconds
+		self.rc_jitter = RollingStatistics()  # Keepalive lateness relative to its deadline, seconds
+		self.n_rc_sent_on_change = 0
 
 	@staticmethod
 	def _rc_clamp(val):
@@ -29,30 +40,75 @@ class RcWrapper(pioneer_sdk.Pioneer):
 		return float(max(min(max_value, val), min_value))
 
 	def reset_rc(self, *args, **kwargs):
-		for k in self.control.keys():
-			if k != "mode":
-				self.control[k] = 0.0
+		self.set_rcs(**{k: 0.0 for k in self.control.keys() if k != "mode"})
 
 	def set_rc(self, key, value):
-		assert key in self.control.keys()
-		if key == "mode":
-			assert value in [0, 1, 2]
-			self.control[key] = value
-		else:
-			self.control[key] = RcWrapper._rc_clamp(value)
+		self.set_rcs(**{key: value})
+
+	def set_rcs(self, **channels):
+		"""
+		Updates several channels at once, so they are sent in one packet, and never some of them updated and the
+		others not
+		"""
+		for key, value in channels.items():
+			assert key in self.control.keys()
+			if key == "mode":
+				assert value in [0, 1, 2]
+			else:
+				channels[key] = RcWrapper._rc_clamp(value)
+
+		with self.rc_lock:
+			changed = any(self.control[key] != value for key, value in channels.items())
+			self.control.update(channels)
+		if changed:
+			self.rc_changed.set()
 
 	def push_rc(self):
-		self.rc_channels(self.control['roll'], self.control['pitch'], self.control['yaw'], self.control['throttle'], self.control['mode'])
+		with self.rc_lock:
+			control = dict(self.control)
+		self.rc_channels(control['roll'], control['pitch'], control['yaw'], control['throttle'], control['mode'])
 
 	def push_rc_task(self):
 		"""
-		Should be used as a thread routine
+		Should be used as a thread routine. Sends RC channels right away when they change, and as keepalives on fixed
+		deadlines `rc_rate` times a second otherwise. The deadlines are absolute, so the rate does not drift with the
+		time it takes to send and log
 		:return:
 		"""
+		period = 1.0 / self.rc_rate
+		deadline = time.monotonic()
+		time_sent = None
+		time_keepalive = None
+
 		while True:
-			debug.FlightLog.add_log_rc(self)
-			self.push_rc()
-			time.sleep(0.05)
+			changed = self.rc_changed.wait(max(deadline - time.monotonic(), 0.0))
+			now = time.monotonic()
+
+			if changed:
+				self.rc_changed.clear()
+				self.push_rc()
+				self.n_rc_sent_on_change += 1
+				time_sent = now
+			elif time_sent is None or now - time_sent >= period / 2:  # Skipped, if a change has just been sent
+				self.push_rc()
+				self.rc_jitter.add(now - deadline)
+				if time_keepalive is not None:
+					self.rc_period.add(now - time_keepalive)
+				time_sent = time_keepalive = now
+
+			if now >= deadline:
+				deadline += period * (1 + int((now - deadline) / period))  # Missed deadlines are skipped, not caught up on
+
+			if time_sent == now:
+				debug.FlightLog.add_log_rc(self)  # After sending, and the deadline does not depend on it
+
+	def get_rc_statistics(self):
+		"""
+		:return: dict with rolling statistics of the keepalive period and jitter, seconds, and the number of RC
+		messages sent on change
+		"""
+		return dict(period=self.rc_period.summary(), jitter=self.rc_jitter.summary(),
+			sent_on_change=self.n_rc_sent_on_change)
 
 
 class AttackStrategy(RcWrapper):
@@ -63,7 +119,9 @@ class AttackStrategy(RcWrapper):
 		delta_threshold_clean=0.0,
 		control_horizontal_range=(-1.0, 1.0,),
 		control_vertical_range=(-1.0, 1.0),
-		n_iterations_control_lag=0):
+		n_iterations_control_lag=0,
+		rc_rate=50.0,
+		command_delay=0.0):
 		"""
 		@param pid_vertical:  -  vertical PID, expected to be pre-initialized
 		@param pid_horizontal:  -  horizontal PID, expected to be pre-initialized
@@ -72,8 +130,11 @@ class AttackStrategy(RcWrapper):
 		@param n_iterations_control_lag:  -  number of iterations to skip before starting to impose control action.
 		@param control_horizontal_range  -  a range regarding to which the control action will be clamped
 		@param control_vertical_range  -  a range regarding to which the control action will be clamped
+		@param rc_rate  -  see `RcWrapper`
+		@param command_delay  -  time it takes the vehicle to act on an RC override, on top of the override reaching
+		it, seconds. See `expected_delivery_time`
 		"""
-		RcWrapper.__init__(self)
+		RcWrapper.__init__(self, rc_rate=rc_rate)
 		self.pid_vertical = pid_vertical
 		self.pid_horizontal = pid_horizontal
 
@@ -89,6 +150,7 @@ class AttackStrategy(RcWrapper):
 
 		self.control_horizontal_range = control_horizontal_range
 		self.control_vertical_range = control_vertical_range
+		self.command_delay = command_delay
 
 		debug.FlightLog.add_log_event(f'initializing controller, '
 			f'control_horizontal_range: {self.control_horizontal_range}, '
@@ -101,6 +163,7 @@ class AttackStrategy(RcWrapper):
 
 
 	def reset_pid(self):
+		self.last_time_seconds = None
 		self.last_offset_horizontal = None
 		self.last_offset_vertical = None
 		self.target_lost = None
@@ -129,7 +192,34 @@ class AttackStrategy(RcWrapper):
 		"""
 		raise NotImplemented
 
-	def on_target(self, offset_horizontal, offset_vertical):
+	def expected_delivery_time(self):
+		"""
+		@return:  -  time.monotonic() an RC override set now is expected to take effect at. Changed RC channels are
+		sent right away, see `push_rc_task`, so it is half the command round trip time, plus `command_delay`, from now
+		"""
+		rtt = self.get_command_rtt()
+		return time.monotonic() + (rtt / 2 if rtt is not None else 0.0) + self.command_delay
+
+	def on_target(self, offset_horizontal, offset_vertical, timestamp=None, predict_offsets=None):
+		"""
+		@param timestamp:  -  time.monotonic() the frame the offsets are inferred from has been received at. If
+		provided, PID's dt is the time between frames rather than between calls
+		@param predict_offsets:  -  callable taking a time.monotonic() and returning the offsets the target is predicted
+		to be at then. If provided, the control action is computed for the offsets predicted for
+		`expected_delivery_time`, rather than for the ones of the frame, which are older by the frame transport,
+		decoding and tracking
+		"""
+		if predict_offsets is not None:
+			offset_horizontal, offset_vertical = predict_offsets(self.expected_delivery_time())
+
+		dt = None
+		latency = None
+		if timestamp is not None:
+			if self.last_time_seconds is not None and timestamp > self.last_time_seconds:
+				dt = timestamp - self.last_time_seconds
+			self.last_time_seconds = timestamp
+			latency = time.monotonic() - timestamp
+
 		# Update the values
 		self.last_offset_horizontal = offset_horizontal
 		self.last_offset_vertical = offset_vertical
@@ -140,17 +230,16 @@ class AttackStrategy(RcWrapper):
 			self.engage()
 			return
 
-		y_control = clamp(self.get_normalized_output_vertical(self.pid_vertical(offset_vertical)), *self.control_vertical_range)
-		x_control = clamp(self.get_normalized_output_horizontal(self.pid_horizontal(offset_horizontal)), *self.control_horizontal_range)
+		y_control = clamp(self.get_normalized_output_vertical(self.pid_vertical(offset_vertical, dt)), *self.control_vertical_range)
+		x_control = clamp(self.get_normalized_output_horizontal(self.pid_horizontal(offset_horizontal, dt)), *self.control_horizontal_range)
 
 		if self.n_iterations_control_lag_left > 0:
 			self.n_iterations_control_lag_left -= 1
 			return
 
-		debug.FlightLog.add_log_engage(y_control, x_control, offset_vertical, offset_horizontal)
+		debug.FlightLog.add_log_engage(y_control, x_control, offset_vertical, offset_horizontal, latency)
 
-		self.set_rc("throttle", y_control)
-		self.set_rc("yaw", x_control)
+		self.set_rcs(throttle=y_control, yaw=x_control)
 
 	def on_target_lost(self):
 		self.target_lost = True
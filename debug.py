@@ -1,12 +1,13 @@
-import matplotlib.pyplot as plt
-import numpy as np
 import csv
 import os
 import datetime
+import threading
 import time
 
 
 ENABLE_DEBUG = True
+LINK_STATISTICS = ['command_rtt', 'heartbeat_interval', 'mavlink_loss', 'video_frame_rate', 'video_throughput', 'video_incomplete_frames']
+LINK_PERCENTILES = ['p50', 'p95', 'p99']
 
 
 class RealTimePlot:
@@ -43,6 +44,8 @@ class RealTimePlot:
 			self.set_y(self.y_data)
 
 	def __init__(self, n_lags):
+		import matplotlib.pyplot as plt
+
 		plt.ion()
 
 		self.data = dict()
@@ -210,6 +213,8 @@ def plot_data(data: dict, key_x_data=None):
 	             data dictionary is considered to be one
 	:data: Data to plot
 	"""
+	import matplotlib.pyplot as plt
+
 	fig, ax = plt.subplots()
 	x_key = list(data.keys())[0] if key_x_data is None else key_x_data
 	x_values = [float(x) for x in data[x_key]]
@@ -222,11 +227,31 @@ def plot_data(data: dict, key_x_data=None):
 	plt.show()
 
 
+class LazyLog:
+	"""
+	A `Log` which gets created, and so its file, on the first write
+	"""
+
+	def __init__(self, *args, **kwargs):
+		self.args = args
+		self.kwargs = kwargs
+		self.log = None
+		self.lock = threading.Lock()
+
+	def write(self, row):
+		if self.log is None:
+			with self.lock:
+				if self.log is None:
+					self.log = Log(*self.args, **self.kwargs)
+		self.log.write(row)
+
+
 class FlightLog:
-	log_engage = Log(file_variant="log-engage-", field_names=['time', 'y_control_throttle', 'x_control_yaw', 'y_error', 'x_error'])
-	log_event = Log(file_variant="log-event-", field_names=['time', 'event'])
-	log_rc = Log(file_variant="log-rc-", field_names=['time', 'throttle', 'yaw', "pitch", "roll", "mode"])
-	log_threshold = Log(file_variant="log-threshold-", field_names=["time", "delta", "delta_threshold_clean", "delta_threshold_preliminary", "engage_state {0; 1}", "target_lost {0; 1}"])
+	log_engage = LazyLog(file_variant="log-engage-", field_names=['time', 'y_control_throttle', 'x_control_yaw', 'y_error', 'x_error', 'latency'])
+	log_event = LazyLog(file_variant="log-event-", field_names=['time', 'event'])
+	log_rc = LazyLog(file_variant="log-rc-", field_names=['time', 'throttle', 'yaw', "pitch", "roll", "mode"])
+	log_threshold = LazyLog(file_variant="log-threshold-", field_names=["time", "delta", "delta_threshold_clean", "delta_threshold_preliminary", "engage_state {0; 1}", "target_lost {0; 1}"])
+	log_link = LazyLog(file_variant="log-link-", field_names=['time'] + [f'{s}_{p}' for s in LINK_STATISTICS for p in LINK_PERCENTILES])
 	time_start_seconds = time.time()
 
 	@staticmethod
@@ -234,10 +259,10 @@ class FlightLog:
 		return time.time() - FlightLog.time_start_seconds
 
 	@staticmethod
-	def add_log_engage(y_control, x_control, y_error, x_error):
+	def add_log_engage(y_control, x_control, y_error, x_error, latency=None):
 		if not ENABLE_DEBUG:
 			return
-		FlightLog.log_engage.write([FlightLog.get_uptime_seconds(), y_control, x_control, y_error, x_error])
+		FlightLog.log_engage.write([FlightLog.get_uptime_seconds(), y_control, x_control, y_error, x_error, latency])
 
 	@staticmethod
 	def add_log_event(event):
@@ -249,6 +274,15 @@ class FlightLog:
 	def add_log_rc(controller):
 		FlightLog.log_rc.write([FlightLog.get_uptime_seconds()] + [controller.control[k] for k in ['throttle', 'yaw', "pitch", "roll", "mode"]])
 
+	@staticmethod
+	def add_log_link(link_statistics: dict):
+		"""
+		@param link_statistics:  -  see `pioneer_sdk.Pioneer.get_link_statistics`
+		"""
+		if not ENABLE_DEBUG:
+			return
+		FlightLog.log_link.write([FlightLog.get_uptime_seconds()] + [link_statistics[s].get(p, float('nan')) for s in LINK_STATISTICS for p in LINK_PERCENTILES])
+
 	@staticmethod
 	def add_log_threshold(delta: float, delta_threshold_clean: float, delta_threshold_preliminary: float, engage_state: bool, target_lost: bool):
 		FlightLog.log_threshold.write([FlightLog.get_uptime_seconds(), delta, delta_threshold_clean, delta_threshold_preliminary, float(engage_state), float(target_lost)])
@@ -0,0 +1,180 @@
+"""
+JPEG decoding in worker processes, so decoding does not compete with tracking for the GIL.
+
+Workers decode into preallocated shared memory frame slots and only report back a slot index and a sequence number,
+decoded frames are never pickled.
+"""
+
+from multiprocessing import shared_memory
+from pioneer_sdk import VideoFrame
+import multiprocessing
+import numpy as np
+import queue
+import time
+
+
+def _decode_worker(shm_name, n_slots, frame_shape, decode_flag, tasks, results):
+    import cv2
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray((n_slots,) + frame_shape, dtype=np.uint8, buffer=shm.buf)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, seq, data = task
+            time_start = time.monotonic()
+            img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), decode_flag)
+            success = img is not None and img.shape == frame_shape
+            if success:
+                slots[slot] = img
+            results.put((slot, seq, success, time.monotonic() - time_start))
+    finally:
+        del slots
+        shm.close()
+
+
+class DecodePool:
+    """
+    Decodes frames submitted with `submit` in a pool of processes. Decoded frames are handed out by `get` in the
+    order of submission, or, if `keep_order` is False, as they come, with the ones older than a frame already handed
+    out being dropped.
+    """
+
+    WORKER_CHECK_PERIOD = .5  # Seconds between checks that the workers are alive while waiting for a frame
+
+    def __init__(self, frame_shape, decode_flag, n_workers=2, n_slots=None, keep_order=True):
+        """
+        :param frame_shape: shape of a decoded frame, frames of a different shape are dropped
+        :param decode_flag: cv2.imdecode flag
+        :param n_slots: number of frame slots, 2 * n_workers + 1 if None
+        """
+        self.frame_shape = tuple(frame_shape)
+        self.keep_order = keep_order
+        n_slots = 2 * n_workers + 1 if n_slots is None else n_slots
+
+        self.__shm = shared_memory.SharedMemory(create=True, size=n_slots * int(np.prod(self.frame_shape)))
+        self.__slots = np.ndarray((n_slots,) + self.frame_shape, dtype=np.uint8, buffer=self.__shm.buf)
+        self.__free_slots = list(range(n_slots))
+        self.__held_slot = None  # Slot of the frame handed out last, released on the next `get`
+        self.__pending = {}  # seq: VideoFrame which has been submitted and not handed out yet
+        self.__decoded = {}  # seq: (slot, success, decode duration)
+        self.__last_seq = 0  # Last handed out
+        self.__next_seq = 0  # Last submitted
+
+        self.__tasks = multiprocessing.Queue()
+        self.__results = multiprocessing.Queue()
+        self.__workers = [multiprocessing.Process(target=_decode_worker,
+                                                  args=(self.__shm.name, n_slots, self.frame_shape, decode_flag,
+                                                        self.__tasks, self.__results), daemon=True)
+                          for _ in range(n_workers)]
+        for worker in self.__workers:
+            worker.start()
+
+        self.n_submitted = 0
+        self.n_dropped_busy = 0  # No free slot at submission
+        self.n_dropped_late = 0  # Decoded after a newer frame has been handed out
+        self.n_failed = 0
+
+    @property
+    def queue_depth(self):
+        """
+        Number of frames submitted and not handed out yet
+        """
+        return len(self.__pending)
+
+    def statistics(self):
+        return dict(queue_depth=self.queue_depth, submitted=self.n_submitted, dropped_busy=self.n_dropped_busy,
+                    dropped_late=self.n_dropped_late, failed=self.n_failed)
+
+    def submit(self, frame):
+        """
+        :param frame: VideoFrame or JPEG frame
+        :return: False, if the frame has been dropped as all the slots are busy
+        """
+        if not self.__free_slots:
+            self.n_dropped_busy += 1
+            return False
+        if not isinstance(frame, VideoFrame):
+            frame = VideoFrame(frame)
+        self.__next_seq += 1
+        self.__pending[self.__next_seq] = frame
+        self.__tasks.put((self.__free_slots.pop(), self.__next_seq, bytes(frame.data)))
+        self.n_submitted += 1
+        return True
+
+    def __collect(self, timeout):
+        try:
+            slot, seq, success, decode_duration = self.__results.get(timeout=timeout)
+        except queue.Empty:
+            return False
+        self.__decoded[seq] = (slot, success, decode_duration)
+        return True
+
+    def __ready_seq(self):
+        if self.keep_order:
+            seq = min(self.__pending, default=None)
+            return seq if seq in self.__decoded else None
+        for seq in sorted(self.__decoded):
+            if seq > self.__last_seq:
+                return seq
+            slot, _, _ = self.__decoded.pop(seq)
+            self.__pending.pop(seq)
+            self.__free_slots.append(slot)
+            self.n_dropped_late += 1
+        return None
+
+    def get(self, timeout=None):
+        """
+        :return: VideoFrame with the decoded frame in `img`, or None on timeout or if nothing has been submitted.
+        `img` is a view of a shared memory slot which is only valid until the next call, copy it if it has to be kept
+        :raises RuntimeError: if a worker has died, the frames it was decoding are lost and would be waited for
+        forever. The pool should be closed and replaced
+        """
+        if self.__held_slot is not None:
+            self.__free_slots.append(self.__held_slot)
+            self.__held_slot = None
+
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while True:
+            while self.__collect(0):
+                pass
+            seq = self.__ready_seq()
+            if seq is not None:
+                slot, success, decode_duration = self.__decoded.pop(seq)
+                frame = self.__pending.pop(seq)
+                self.__last_seq = seq
+                if not success:
+                    self.__free_slots.append(slot)
+                    self.n_failed += 1
+                    continue
+                self.__held_slot = slot
+                frame.img = self.__slots[slot]
+                frame.decode_duration = decode_duration
+                return frame
+            if not self.__pending:
+                return None
+            remaining = deadline - time.monotonic() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return None
+            if not self.__collect(min(remaining, self.WORKER_CHECK_PERIOD) if remaining is not None
+                                  else self.WORKER_CHECK_PERIOD):
+                self.__check_workers()
+
+    def __check_workers(self):
+        for worker in self.__workers:
+            if not worker.is_alive():
+                raise RuntimeError('decode worker %d has died with exit code %s' % (worker.pid, worker.exitcode))
+
+    def close(self):
+        for _ in self.__workers:
+            self.__tasks.put(None)
+        for worker in self.__workers:
+            worker.join()
+        del self.__slots
+        self.__shm.unlink()
+        try:
+            self.__shm.close()
+        except BufferError:  # A frame handed out is still referenced, the mapping goes away along with it
+            pass
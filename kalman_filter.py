@@ -1,5 +1,5 @@
+import math
 import numpy as np
-import scipy.linalg
 
 
 """
@@ -34,9 +34,25 @@ class KalmanFilter(object):
     (x, y, a, h) is taken as direct observation of the state space (linear
     observation model).
 
+    Predictions are one time unit ahead, unless given the time elapsed. The
+    motion model for an elapsed time is built once per `DT_QUANTUM` and
+    cached.
+
     """
 
-    def __init__(self):
+    DT_QUANTUM = 1. / 16  # Elapsed times are rounded to it, in time units
+    MAX_DT = 64.  # Elapsed times are capped at it, in time units
+
+    def __init__(self, time_unit=1.):
+        """
+        Parameters
+        ----------
+        time_unit : float
+            Time the elapsed times given to `predict` are divided by.
+            Velocities are per time unit, and the motion uncertainty is chosen
+            for a step of one time unit.
+
+        """
         ndim, dt = 4, 1.
 
         # Create Kalman filter model matrices.
@@ -51,6 +67,21 @@ class KalmanFilter(object):
         self._std_weight_position = 1. / 20
         self._std_weight_velocity = 1. / 160
 
+        # Standard deviations of the motion and the observation noise are
+        # these times the height, but for the ones of the aspect ratio and its
+        # velocity, which are constant.
+        w_pos, w_vel = self._std_weight_position, self._std_weight_velocity
+        self._motion_std_weights = np.array(
+            [w_pos, w_pos, 0., w_pos, w_vel, w_vel, 0., w_vel])
+        self._motion_std_offsets = np.array(
+            [0., 0., 1e-2, 0., 0., 0., 1e-5, 0.])
+        self._innovation_std_weights = np.array([w_pos, w_pos, 0., w_pos])
+
+        self._time_unit = time_unit
+        # Quantized elapsed time: motion matrix, and weights and offsets of
+        # the motion standard deviations
+        self._motion_models = {}
+
     def initiate(self, measurement):
         """Create track from unassociated measurement.
 
@@ -84,7 +115,7 @@ class KalmanFilter(object):
         covariance = np.diag(np.square(std))
         return mean, covariance
 
-    def predict(self, mean, covariance):
+    def predict(self, mean, covariance, dt=None):
         """Run Kalman filter prediction step.
 
         Parameters
@@ -95,6 +126,8 @@ class KalmanFilter(object):
         covariance : ndarray
             The 8x8 dimensional covariance matrix of the object state at the
             previous time step.
+        dt : Optional[float]
+            Time elapsed since the previous time step, one time unit if None.
 
         Returns
         -------
@@ -103,23 +136,9 @@ class KalmanFilter(object):
             state. Unobserved velocities are initialized to 0 mean.
 
         """
-        std_pos = [
-            self._std_weight_position * mean[3],
-            self._std_weight_position * mean[3],
-            1e-2,
-            self._std_weight_position * mean[3]]
-        std_vel = [
-            self._std_weight_velocity * mean[3],
-            self._std_weight_velocity * mean[3],
-            1e-5,
-            self._std_weight_velocity * mean[3]]
-        motion_cov = np.diag(np.square(np.r_[std_pos, std_vel]))
-
-        mean = np.dot(self._motion_mat, mean)
-        covariance = np.linalg.multi_dot((
-            self._motion_mat, covariance, self._motion_mat.T)) + motion_cov
-
-        return mean, covariance
+        mean, covariance = self.predict_batch(
+            mean[None], covariance[None], dt)
+        return mean[0], covariance[0]
 
     def project(self, mean, covariance):
         """Project state distribution to measurement space.
@@ -138,17 +157,8 @@ class KalmanFilter(object):
             estimate.
 
         """
-        std = [
-            self._std_weight_position * mean[3],
-            self._std_weight_position * mean[3],
-            1e-1,
-            self._std_weight_position * mean[3]]
-        innovation_cov = np.diag(np.square(std))
-
-        mean = np.dot(self._update_mat, mean)
-        covariance = np.linalg.multi_dot((
-            self._update_mat, covariance, self._update_mat.T))
-        return mean, covariance + innovation_cov
+        mean, covariance = self.project_batch(mean[None], covariance[None])
+        return mean[0], covariance[0]
 
     def update(self, mean, covariance, measurement):
         """Run Kalman filter correction step.
@@ -170,19 +180,9 @@ class KalmanFilter(object):
             Returns the measurement-corrected state distribution.
 
         """
-        projected_mean, projected_cov = self.project(mean, covariance)
-
-        chol_factor, lower = scipy.linalg.cho_factor(
-            projected_cov, lower=True, check_finite=False)
-        kalman_gain = scipy.linalg.cho_solve(
-            (chol_factor, lower), np.dot(covariance, self._update_mat.T).T,
-            check_finite=False).T
-        innovation = measurement - projected_mean
-
-        new_mean = mean + np.dot(innovation, kalman_gain.T)
-        new_covariance = covariance - np.linalg.multi_dot((
-            kalman_gain, projected_cov, kalman_gain.T))
-        return new_mean, new_covariance
+        mean, covariance = self.update_batch(
+            mean[None], covariance[None], np.asarray(measurement)[None])
+        return mean[0], covariance[0]
 
     def gating_distance(self, mean, covariance, measurements,
                         only_position=False):
@@ -201,7 +201,8 @@ class KalmanFilter(object):
         measurements : ndarray
             An Nx4 dimensional matrix of N measurements, each in
             format (x, y, a, h) where (x, y) is the bounding box center
-            position, a the aspect ratio, and h the height.
+            position, a the aspect ratio, and h the height. A single 4
+            dimensional measurement is accepted as well.
         only_position : Optional[bool]
             If True, distance computation is done with respect to the bounding
             box center position only.
@@ -211,18 +212,336 @@ class KalmanFilter(object):
         ndarray
             Returns an array of length N, where the i-th element contains the
             squared Mahalanobis distance between (mean, covariance) and
-            `measurements[i]`.
+            `measurements[i]`. A scalar for a single measurement.
+
+        """
+        measurements = np.asarray(measurements)
+        squared_maha = self.gating_distance_batch(
+            mean[None], covariance[None], np.atleast_2d(measurements),
+            only_position)[0]
+        return squared_maha[0] if measurements.ndim == 1 else squared_maha
+
+    def elapsed(self, dt=None):
+        """Time a prediction step covers.
+
+        Parameters
+        ----------
+        dt : Optional[float]
+            Time elapsed since the previous time step, one time unit if None.
+
+        Returns
+        -------
+        float
+            `dt` rounded to `DT_QUANTUM` and capped at `MAX_DT`, the way the
+            prediction step applies it. Adding it to the time of a state
+            gives the time of the predicted state.
+
+        """
+        return self._steps(dt) * self.DT_QUANTUM * self._time_unit
+
+    def _steps(self, dt):
+        """Elapsed time in `DT_QUANTUM` units."""
+        if dt is None:
+            return int(round(1. / self.DT_QUANTUM))
+        steps = int(round(dt / self._time_unit / self.DT_QUANTUM))
+        return min(max(steps, 0), int(round(self.MAX_DT / self.DT_QUANTUM)))
+
+    def _motion_model(self, dt):
+        """Motion matrix, and weights and offsets the motion standard
+        deviations are computed from the height with, for an elapsed time.
+        The motion variance grows linearly with the time elapsed."""
+        steps = self._steps(dt)
+        model = self._motion_models.get(steps)
+        if model is None:
+            dt = steps * self.DT_QUANTUM
+            motion_mat = np.eye(8, 8)
+            motion_mat[range(4), range(4, 8)] = dt
+            scale = math.sqrt(dt)
+            model = (motion_mat, self._motion_std_weights * scale,
+                     self._motion_std_offsets * scale)
+            self._motion_models[steps] = model
+        return model
+
+    def _motion_variance_batch(self, mean, std_weights, std_offsets):
+        """Diagonal of the motion covariance of every track, (N, 8)."""
+        return np.square(mean[:, 3:4] * std_weights + std_offsets)
+
+    def _innovation_variance_batch(self, mean):
+        """Diagonal of the observation covariance of every track, (N, 4)."""
+        std = mean[:, 3:4] * self._innovation_std_weights
+        std[:, 2] = 1e-1
+        return np.square(std)
+
+    def predict_batch(self, mean, covariance, dt=None):
+        """Run Kalman filter prediction step for N tracks at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors of the tracks at the previous
+            time step.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices of the tracks at the
+            previous time step.
+        dt : Optional[float]
+            Time elapsed since the previous time step, one time unit if None.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the mean vectors and covariance matrices of the predicted
+            states.
+
+        """
+        diagonal = np.arange(8)
+        motion_mat, std_weights, std_offsets = self._motion_model(dt)
+        motion_variance = self._motion_variance_batch(
+            mean, std_weights, std_offsets)
+
+        mean = np.dot(mean, motion_mat.T)
+        covariance = np.matmul(
+            np.matmul(motion_mat, covariance), motion_mat.T)
+        covariance[:, diagonal, diagonal] += motion_variance
+        return mean, covariance
+
+    def project_batch(self, mean, covariance):
+        """Project the state distributions of N tracks to measurement space.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the Nx4 projected means and Nx4x4 covariance matrices.
 
         """
-        mean, covariance = self.project(mean, covariance)
+        diagonal = np.arange(4)
+
+        projected_mean = np.dot(mean, self._update_mat.T)
+        projected_cov = np.matmul(
+            np.matmul(self._update_mat, covariance), self._update_mat.T)
+        projected_cov[:, diagonal, diagonal] += \
+            self._innovation_variance_batch(mean)
+        return projected_mean, projected_cov
+
+    def update_batch(self, mean, covariance, measurement):
+        """Run Kalman filter correction step for N tracks at once.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The predicted Nx8 dimensional mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices.
+        measurement : ndarray
+            The Nx4 dimensional measurements (x, y, a, h), one for every
+            track.
+
+        Returns
+        -------
+        (ndarray, ndarray)
+            Returns the measurement-corrected state distributions.
+
+        """
+        projected_mean, projected_cov = self.project_batch(mean, covariance)
+
+        # The innovation covariance is symmetric positive definite, a batched
+        # solve is cheaper than a Cholesky factorization followed by two
+        # triangular solves, which numpy can only do one matrix at a time
+        kalman_gain = np.linalg.solve(
+            projected_cov,
+            np.matmul(covariance, self._update_mat.T).transpose(0, 2, 1)
+        ).transpose(0, 2, 1)
+        innovation = measurement - projected_mean
+
+        new_mean = mean + np.einsum('nij,nj->ni', kalman_gain, innovation)
+        new_covariance = covariance - np.matmul(
+            np.matmul(kalman_gain, projected_cov),
+            kalman_gain.transpose(0, 2, 1))
+        return new_mean, new_covariance
+
+    def gating_distance_batch(self, mean, covariance, measurements,
+                              only_position=False):
+        """Compute gating distance between the state distributions of N
+        tracks and measurements.
+
+        Parameters
+        ----------
+        mean : ndarray
+            The Nx8 dimensional mean vectors.
+        covariance : ndarray
+            The Nx8x8 dimensional covariance matrices.
+        measurements : ndarray
+            Measurements in format (x, y, a, h), of a shape which broadcasts
+            to NxMx4: Mx4 to gate every measurement against every track, or
+            Nx1x4 to gate each track against a measurement of its own.
+        only_position : Optional[bool]
+            If True, distance computation is done with respect to the bounding
+            box center position only.
+
+        Returns
+        -------
+        ndarray
+            Returns an NxM array, where the (i, j)-th element contains the
+            squared Mahalanobis distance between track i and measurement j.
+
+        """
+        mean, covariance = self.project_batch(mean, covariance)
+        measurements = np.asarray(measurements)
         if only_position:
-            mean, covariance = mean[:2], covariance[:2, :2]
-            measurements = measurements[:, :2]
+            mean, covariance = mean[:, :2], covariance[:, :2, :2]
+            measurements = measurements[..., :2]
 
         cholesky_factor = np.linalg.cholesky(covariance)
-        d = measurements - mean
-        z = scipy.linalg.solve_triangular(
-            cholesky_factor, d.T, lower=True, check_finite=False,
-            overwrite_b=True)
-        squared_maha = np.sum(z * z, axis=0)
-        return squared_maha
+        d = measurements - mean[:, None, :]
+        z = np.linalg.solve(cholesky_factor, d.transpose(0, 2, 1))
+        return np.einsum('nim,nim->nm', z, z)
+
+
+class KalmanFilterInPlace(KalmanFilter):
+    """
+    A Kalman filter for a single track, which owns the track's state and
+    updates it in place.
+
+    `mean` and `covariance` are allocated once, along with the workspaces the
+    steps are computed in, and are only ever written to with `out=`
+    arguments, so references to them stay valid. At the size of this filter
+    the cost of the allocating API is mostly numpy and scipy call overhead,
+    the 4x4 innovation covariance is therefore factorized and inverted with
+    unrolled scalar code rather than LAPACK.
+
+    The observation model is taken to pick the first 4 state variables, as
+    the one of `KalmanFilter` does.
+
+    """
+
+    def __init__(self, measurement, time_unit=1.):
+        """
+        Parameters
+        ----------
+        measurement : ndarray
+            Bounding box coordinates (x, y, a, h) to initiate the track from,
+            see `KalmanFilter.initiate`.
+        time_unit : float
+            See `KalmanFilter`.
+
+        """
+        super().__init__(time_unit)
+        mean, covariance = self.initiate(
+            np.asarray(measurement, dtype=np.float64))
+        self.mean = np.ascontiguousarray(mean)
+        self.covariance = np.ascontiguousarray(covariance)
+
+        self._covariance_diagonal = self.covariance.reshape(-1)[::9]
+        self._motion_variance = np.empty(8)
+        self._innovation_variance = np.empty(4)
+        self._innovation_cov = np.empty((4, 4))
+        self._innovation_cov_diagonal = self._innovation_cov.reshape(-1)[::5]
+        self._cholesky_inv = np.zeros((4, 4))
+        self._innovation_cov_inv = np.empty((4, 4))
+        self._kalman_gain = np.empty((8, 4))
+        self._gain_cov = np.empty((8, 4))
+        self._innovation = np.empty(4)
+        self._z = np.empty(4)
+        self._mean = np.empty(8)
+        self._product = np.empty((8, 8))
+
+    def predict_state(self, dt=None):
+        """Run Kalman filter prediction step on the state.
+
+        Parameters
+        ----------
+        dt : Optional[float]
+            Time elapsed since the previous time step, one time unit if None.
+
+        """
+        motion_mat, std_weights, std_offsets = self._motion_model(dt)
+        np.multiply(std_weights, self.mean[3], out=self._motion_variance)
+        self._motion_variance += std_offsets
+        np.square(self._motion_variance, out=self._motion_variance)
+
+        np.matmul(motion_mat, self.mean, out=self._mean)
+        self.mean[:] = self._mean
+        np.matmul(motion_mat, self.covariance, out=self._product)
+        np.matmul(self._product, motion_mat.T, out=self.covariance)
+        self._covariance_diagonal += self._motion_variance
+
+    def update_state(self, measurement):
+        """Run Kalman filter correction step on the state.
+
+        Parameters
+        ----------
+        measurement : ndarray
+            The 4 dimensional measurement vector (x, y, a, h), where (x, y)
+            is the center position, a the aspect ratio, and h the height of the
+            bounding box.
+
+        """
+        self._project_state()
+        np.matmul(self._cholesky_inv.T, self._cholesky_inv,
+                  out=self._innovation_cov_inv)
+        np.matmul(self.covariance[:, :4], self._innovation_cov_inv,
+                  out=self._kalman_gain)
+        np.subtract(measurement, self.mean[:4], out=self._innovation)
+
+        np.matmul(self._kalman_gain, self._innovation, out=self._mean)
+        self.mean += self._mean
+        np.matmul(self._kalman_gain, self._innovation_cov, out=self._gain_cov)
+        np.matmul(self._gain_cov, self._kalman_gain.T, out=self._product)
+        self.covariance -= self._product
+
+    def gating_distance_state(self, measurement):
+        """Compute the squared Mahalanobis distance between the state and a
+        single 4 dimensional measurement (x, y, a, h), see
+        `KalmanFilter.gating_distance`.
+
+        """
+        self._project_state()
+        np.subtract(measurement, self.mean[:4], out=self._innovation)
+        np.matmul(self._cholesky_inv, self._innovation, out=self._z)
+        return float(np.dot(self._z, self._z))
+
+    def _project_state(self):
+        """Compute the innovation covariance of the state, and the inverse of
+        its Cholesky factor, into the workspaces."""
+        np.multiply(self._innovation_std_weights, self.mean[3],
+                    out=self._innovation_variance)
+        self._innovation_variance[2] = 1e-1
+        np.square(self._innovation_variance, out=self._innovation_variance)
+        self._innovation_cov[:] = self.covariance[:4, :4]
+        self._innovation_cov_diagonal += self._innovation_variance
+        _cholesky_inv_4x4(self._innovation_cov, self._cholesky_inv)
+
+
+def _cholesky_inv_4x4(a, out):
+    """Write the inverse of the lower Cholesky factor of a symmetric positive
+    definite 4x4 matrix `a` to the lower triangle of `out`."""
+    a = a.item
+    l00 = math.sqrt(a(0, 0))
+    l10 = a(1, 0) / l00
+    l20 = a(2, 0) / l00
+    l30 = a(3, 0) / l00
+    l11 = math.sqrt(a(1, 1) - l10 * l10)
+    l21 = (a(2, 1) - l20 * l10) / l11
+    l31 = (a(3, 1) - l30 * l10) / l11
+    l22 = math.sqrt(a(2, 2) - l20 * l20 - l21 * l21)
+    l32 = (a(3, 2) - l30 * l20 - l31 * l21) / l22
+    l33 = math.sqrt(a(3, 3) - l30 * l30 - l31 * l31 - l32 * l32)
+
+    m00, m11, m22, m33 = 1. / l00, 1. / l11, 1. / l22, 1. / l33
+    m10 = -l10 * m00 * m11
+    m21 = -l21 * m11 * m22
+    m20 = -(l20 * m00 + l21 * m10) * m22
+    m32 = -l32 * m22 * m33
+    m31 = -(l31 * m11 + l32 * m21) * m33
+    m30 = -(l30 * m00 + l31 * m10 + l32 * m20) * m33
+
+    out[0, 0] = m00
+    out[1, 0], out[1, 1] = m10, m11
+    out[2, 0], out[2, 1], out[2, 2] = m20, m21, m22
+    out[3, 0], out[3, 1], out[3, 2], out[3, 3] = m30, m31, m32, m33
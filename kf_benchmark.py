@@ -0,0 +1,94 @@
+"""
+Micro-benchmark of `kalman_filter.KalmanFilter`: per-track cost of predict, update and gating, done track by track
+through the single-track API versus for all the tracks at once through the batch one, and the cost of the single-track
+API versus `KalmanFilterInPlace`.
+
+    python3 kf_benchmark.py
+    python3 kf_benchmark.py --n-tracks 1 10 100 1000 --duration .2
+"""
+
+from kalman_filter import KalmanFilter, KalmanFilterInPlace
+import argparse
+import time
+import numpy as np
+
+
+def _tracks(kf, n_tracks, rng):
+    measurements = np.column_stack((rng.uniform(0, 640, n_tracks), rng.uniform(0, 480, n_tracks),
+                                    rng.uniform(.5, 2, n_tracks), rng.uniform(20, 120, n_tracks)))
+    states = [kf.initiate(measurement) for measurement in measurements]
+    mean = np.array([mean for mean, _ in states])
+    covariance = np.array([covariance for _, covariance in states])
+    mean, covariance = kf.predict_batch(mean, covariance)
+    return mean, covariance, measurements + rng.normal(0, 1, measurements.shape) * (1, 1, .01, 1)
+
+
+def _time(function, duration):
+    """
+    :return: seconds per call, over as many calls as fit `duration`
+    """
+    n = 0
+    time_start = time.perf_counter()
+    while True:
+        function()
+        n += 1
+        elapsed = time.perf_counter() - time_start
+        if elapsed >= duration:
+            return elapsed / n
+
+
+def benchmark(n_tracks, duration):
+    kf = KalmanFilter()
+    rng = np.random.default_rng(0)
+    print('%8s %-8s %12s %12s %8s' % ('tracks', 'step', 'single, us', 'batch, us', 'speedup'))
+    for n in n_tracks:
+        mean, covariance, measurements = _tracks(kf, n, rng)
+        steps = {
+            'predict': (lambda: [kf.predict(mean[i], covariance[i]) for i in range(n)],
+                        lambda: kf.predict_batch(mean, covariance)),
+            'update': (lambda: [kf.update(mean[i], covariance[i], measurements[i]) for i in range(n)],
+                       lambda: kf.update_batch(mean, covariance, measurements)),
+            'gating': (lambda: [kf.gating_distance(mean[i], covariance[i], measurements[i]) for i in range(n)],
+                       lambda: kf.gating_distance_batch(mean, covariance, measurements[:, None])),
+        }
+        for name, (single, batch) in steps.items():
+            time_single = _time(single, duration) / n
+            time_batch = _time(batch, duration) / n
+            print('%8d %-8s %12.2f %12.2f %7.1fx' % (n, name, time_single * 1e6, time_batch * 1e6,
+                                                     time_single / time_batch))
+
+
+def benchmark_in_place(duration):
+    kf = KalmanFilter()
+    mean, covariance, measurements = _tracks(kf, 1, np.random.default_rng(0))
+    mean, covariance, measurement = mean[0], covariance[0], measurements[0]
+    kf_in_place = KalmanFilterInPlace(measurement)
+    kf_in_place.predict_state()
+
+    print('%-8s %12s %12s %8s' % ('step', 'single, us', 'in place, us', 'speedup'))
+    steps = {
+        'predict': (lambda: kf.predict(mean, covariance), kf_in_place.predict_state),
+        'update': (lambda: kf.update(mean, covariance, measurement),
+                   lambda: kf_in_place.update_state(measurement)),
+        'gating': (lambda: kf.gating_distance(mean, covariance, measurement),
+                   lambda: kf_in_place.gating_distance_state(measurement)),
+    }
+    for name, (single, in_place) in steps.items():
+        time_single = _time(single, duration)
+        time_in_place = _time(in_place, duration)
+        print('%-8s %12.2f %12.2f %7.1fx' % (name, time_single * 1e6, time_in_place * 1e6,
+                                             time_single / time_in_place))
+
+
+def getarparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n-tracks', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--duration', type=float, default=.5, help='seconds spent timing each step')
+    return parser
+
+
+if __name__ == '__main__':
+    opts = getarparser().parse_args()
+    benchmark(opts.n_tracks, opts.duration)
+    print()
+    benchmark_in_place(opts.duration)
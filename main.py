@@ -6,7 +6,6 @@ import numpy as np
 import math
 
 from tracker_propagation import TrackerPropagation, TRACKER_STATES
-from PyQt5.QtWidgets import QApplication
 
 def getarparser():
 
@@ -52,7 +51,6 @@ fov = lambda frame_size : 2.*math.atan2(max(frame_size), max(frame_size)*1.5)
 if __name__ == '__main__':
 
     opts = getarparser().parse_args()
-    app = QApplication(sys.argv)
 
     camera = cv2.VideoCapture(0)
     ret_err, img = camera.read()
@@ -8,7 +8,6 @@ import math
 import pioneer_sdk
 
 from tracker_propagation import TrackerPropagation, TRACKER_STATES
-from PyQt5.QtWidgets import QApplication
 
 def getarparser():
 
@@ -70,7 +69,6 @@ def pioneer_get_frame():
 if __name__ == '__main__':
 
     opts = getarparser().parse_args()
-    app = QApplication(sys.argv)
 
     # camera = cv2.VideoCapture(0)
     # ret_err, img = camera.read()
@@ -1,6 +1,5 @@
 from camera import Camera
 import argparse
-from PyQt5.QtWidgets import QApplication
 import sys
 import cv2
 import pioneer_sdk
@@ -18,7 +17,6 @@ def getarparser():
 
 if __name__ == "__main__":
 	opts = getarparser().parse_args()
-	app = QApplication(sys.argv)
 	pioneer = pioneer_sdk.Pioneer()
 
 	camera = Camera(pioneer.get_raw_video_frame)
@@ -0,0 +1,33 @@
+import collections
+import threading
+
+
+class RollingStatistics:
+	"""
+	Statistics over the last `maxlen` samples of a value
+	"""
+
+	def __init__(self, maxlen=256):
+		self.samples = collections.deque(maxlen=maxlen)
+		self.n_samples = 0  # Overall, not only the ones in the window
+		self.lock = threading.Lock()
+
+	def add(self, value):
+		with self.lock:
+			self.samples.append(value)
+			self.n_samples += 1
+
+	def summary(self):
+		"""
+		:return: dict of n, mean, p50, p95, p99, and max over the window. Only n, if the window is empty
+		"""
+		with self.lock:
+			samples = sorted(self.samples)
+		if not samples:
+			return dict(n=self.n_samples)
+
+		def percentile(q):
+			return samples[min(int(len(samples) * q), len(samples) - 1)]
+
+		return dict(n=self.n_samples, mean=sum(samples) / len(samples), p50=percentile(.5), p95=percentile(.95),
+			p99=percentile(.99), max=samples[-1])
@@ -0,0 +1,313 @@
+"""
+asyncio client for the Pioneer. Video datagrams, MAVLink parsing, heartbeats and commands share one event loop, so
+there are no threads spinning while waiting for the vehicle.
+
+    async def main():
+        pioneer = await AsyncPioneer().connect()
+        await pioneer.arm()
+        async for frame in pioneer.frames():
+            ...
+"""
+
+from pymavlink import mavutil
+from pioneer_sdk import VideoFrameBuffer, ACK_RESULTS, MAV_RESULT_IN_PROGRESS, rc_channels_values, \
+    local_point_parameters
+import argparse
+import asyncio
+import collections
+import time
+
+
+class _DatagramWriter:
+    """
+    File-like adapter pymavlink writes encoded messages to
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+
+    def write(self, buf):
+        self.transport.sendto(buf)
+
+
+class _VideoProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, pioneer):
+        self.pioneer = pioneer
+
+    def datagram_received(self, data, addr):
+        self.pioneer._on_video_datagram(data)
+
+
+class _MavlinkProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, pioneer):
+        self.pioneer = pioneer
+
+    def datagram_received(self, data, addr):
+        self.pioneer._on_mavlink_datagram(data)
+
+
+class AsyncPioneer:
+
+    def __init__(self, pioneer_ip='192.168.4.1', pioneer_video_control_port=8888, pioneer_mavlink_port=8001,
+                 logger=True, heartbeat_period=1., ack_timeout=1., n_retries=10):
+        """
+        :param n_retries: number of times a command is sent before giving up
+        """
+        self.__ip = pioneer_ip
+        self.__video_control_port = pioneer_video_control_port
+        self.__mavlink_port = pioneer_mavlink_port
+        self.__logger = logger
+        self.__heartbeat_period = heartbeat_period
+        self.__ack_timeout = ack_timeout
+        self.__n_retries = n_retries
+
+        self.__video_control_writer = None
+        self.__video_transport = None
+        self.__mavlink_transport = None
+        self.__heartbeat_task = None
+        self.__mav_writer = _DatagramWriter(None)  # Gets the transport in `connect`
+        self.__mav = mavutil.mavlink.MAVLink(self.__mav_writer, srcSystem=255)
+        self.__mav.robust_parsing = True  # A corrupt message is returned as BAD_DATA instead of raising
+        self.n_mavlink_bad_data = 0  # Corrupt or unknown messages skipped
+        self.target_system = 0
+        self.target_component = 0
+
+        self.__video_frame_buffer = VideoFrameBuffer()
+        self.__video_frame = None  # Newest frame which has not been taken yet
+        self.__video_frame_event = asyncio.Event()
+        self.n_video_frames_dropped = 0
+
+        self.__heartbeat_event = asyncio.Event()
+        self.__ack_futures = {}  # MAV_CMD: future resolved with COMMAND_ACK
+        self.__command_locks = collections.defaultdict(asyncio.Lock)  # MAV_CMD: lock held while the command is sent
+        self.__position_futures = []  # Resolved with POSITION_TARGET_LOCAL_NED
+        self.__point_reached_futures = []  # Resolved with the id of a newly reached point
+        self.__point_id = None  # Id of the last point reached
+        self.__prev_point_id = None  # Id of the last point returned by `point_reached`
+        self.messages = {}  # Message type: latest message
+
+    async def connect(self):
+        """
+        Connects to the vehicle, and waits for a heartbeat and a reached point, same as `pioneer_sdk.Pioneer`
+        :return: self
+        """
+        loop = asyncio.get_running_loop()
+        _, self.__video_control_writer = await asyncio.wait_for(
+            asyncio.open_connection(self.__ip, self.__video_control_port), 5)
+        self.__video_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _VideoProtocol(self), local_addr=self.__video_control_writer.get_extra_info('sockname'))
+        self.__mavlink_transport, _ = await loop.create_datagram_endpoint(
+            lambda: _MavlinkProtocol(self), remote_addr=(self.__ip, self.__mavlink_port))
+        self.__mav_writer.transport = self.__mavlink_transport
+
+        self.__heartbeat_task = asyncio.ensure_future(self.__send_heartbeats())
+        await self.__heartbeat_event.wait()
+        await self.point_reached()
+        return self
+
+    async def close(self):
+        if self.__heartbeat_task is not None:
+            self.__heartbeat_task.cancel()
+        for transport in (self.__video_transport, self.__mavlink_transport):
+            if transport is not None:
+                transport.close()
+        if self.__video_control_writer is not None:
+            self.__video_control_writer.close()
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def _on_video_datagram(self, data):
+        self.__video_frame_buffer.feed(data)
+        frame = self.__video_frame_buffer.latest_frame()
+        if frame is None:
+            return
+        frame.data = bytes(frame.data)
+        if self.__video_frame is not None:
+            self.n_video_frames_dropped += 1
+        self.__video_frame = frame
+        self.__video_frame_event.set()
+
+    def _on_mavlink_datagram(self, data):
+        for message in self.__mav.parse_buffer(data) or ():
+            message_type = message.get_type()
+            if message_type == 'BAD_DATA':  # Bad CRC or unknown id, e.g. damaged on a lossy link
+                self.n_mavlink_bad_data += 1
+                continue
+            self.messages[message_type] = message
+            if message_type == 'HEARTBEAT':
+                self.target_system = message.get_srcSystem()
+                self.target_component = message.get_srcComponent()
+                if self.__logger and not self.__heartbeat_event.is_set():
+                    print("Heartbeat from system (system %u component %u)" % (self.target_system,
+                                                                              self.target_component))
+                self.__heartbeat_event.set()
+            elif message_type == 'COMMAND_ACK':
+                future = self.__ack_futures.get(message.command)
+                if future is not None and not future.done():
+                    future.set_result(message.result)
+            elif message_type == 'POSITION_TARGET_LOCAL_NED':
+                self.__resolve(self.__position_futures, message)
+            elif message_type == 'MISSION_ITEM_REACHED':
+                if self.__point_id is None or message.seq > self.__point_id:
+                    self.__point_id = message.seq
+                    if self.__logger:
+                        print("point reached, id: ", message.seq)
+                    self.__resolve(self.__point_reached_futures, message.seq)
+
+    @staticmethod
+    def __resolve(futures, result):
+        for future in futures:
+            if not future.done():
+                future.set_result(result)
+        futures.clear()
+
+    async def __send_heartbeats(self):
+        while True:
+            self.__mav.heartbeat_send(mavutil.mavlink.MAV_TYPE_GCS, mavutil.mavlink.MAV_AUTOPILOT_INVALID, 0, 0, 0)
+            await asyncio.sleep(self.__heartbeat_period)
+
+    async def get_video_frame(self, timeout=None):
+        """
+        :return: the newest VideoFrame which has not been taken yet, or None on timeout
+        """
+        try:
+            await asyncio.wait_for(self.__video_frame_event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        self.__video_frame_event.clear()
+        frame, self.__video_frame = self.__video_frame, None
+        return frame
+
+    async def frames(self):
+        """
+        Iterates over the newest frames, the ones which have arrived while the consumer was busy are skipped
+        """
+        while True:
+            yield await self.get_video_frame()
+
+    async def command_long(self, command, param1=0, param2=0, param3=0, param4=0, param5=0, param6=0, param7=0,
+                           target_component=None):
+        """
+        Sends a command until it is acknowledged
+        :return: True, if the command has been accepted, False if it has been refused or has not been acknowledged
+        """
+        if target_component is None:
+            target_component = self.target_component
+        # COMMAND_ACK only tells the command, so a concurrent call with the same one would take the other's ack
+        async with self.__command_locks[command]:
+            for confirmation in range(self.__n_retries):
+                self.__mav.command_long_send(self.target_system, target_component, command, confirmation, param1,
+                                             param2, param3, param4, param5, param6, param7)
+                result = await self.__wait_ack(command)
+                while result == MAV_RESULT_IN_PROGRESS:  # Wait for the final ack without sending the command again
+                    if self.__logger:
+                        print(ACK_RESULTS[result][0])
+                    result = await self.__wait_ack(command)
+                if result is None:
+                    continue
+                name, outcome = ACK_RESULTS.get(result, ('MAV_RESULT %d' % result, False))
+                if self.__logger:
+                    print(name)
+                if outcome is not None:
+                    return outcome
+        return False
+
+    async def __wait_ack(self, command):
+        """
+        Sending does not yield to the event loop, so the ack to a command sent right before cannot be missed
+        :return: MAV_RESULT of the next COMMAND_ACK to the command, or None on timeout
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.__ack_futures[command] = future
+        try:
+            return await asyncio.wait_for(future, self.__ack_timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            self.__ack_futures.pop(command, None)
+
+    async def arm(self):
+        return await self.command_long(mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 1)
+
+    async def disarm(self):
+        return await self.command_long(mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 0)
+
+    async def takeoff(self):
+        return await self.command_long(mavutil.mavlink.MAV_CMD_NAV_TAKEOFF)
+
+    async def land(self):
+        return await self.command_long(mavutil.mavlink.MAV_CMD_NAV_LAND)
+
+    def rc_channels(self, roll, pitch, yaw, throttle, mode):
+        """
+        See `pioneer_sdk.Pioneer.rc_channels`. Sending does not block, so there is nothing to await
+        """
+        self.__mav.rc_channels_override_send(self.target_system, self.target_component,
+                                             *rc_channels_values(roll, pitch, yaw, throttle, mode))
+
+    async def go_to_local_point(self, x=None, y=None, z=None, vx=None, vy=None, vz=None, afx=None, afy=None,
+                                afz=None, yaw=None, yaw_rate=None, ack_timeout=.1):
+        """
+        Sends the point until the vehicle echoes it back. Use `point_reached` to wait for the point to be reached
+        :return: True, if the point has been acknowledged
+        """
+        mask, parameters = local_point_parameters(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, afx=afx, afy=afy, afz=afz,
+                                                  yaw=yaw, yaw_rate=yaw_rate)
+        loop = asyncio.get_running_loop()
+        for _ in range(self.__n_retries):
+            future = loop.create_future()
+            self.__position_futures.append(future)
+            self.__mav.set_position_target_local_ned_send(0, self.target_system, self.target_component,
+                                                          mavutil.mavlink.MAV_FRAME_LOCAL_NED, mask,
+                                                          parameters['x'], parameters['y'], parameters['z'],
+                                                          parameters['vx'], parameters['vy'], parameters['vz'],
+                                                          parameters['afx'], parameters['afy'], parameters['afz'],
+                                                          parameters['yaw'], parameters['yaw_rate'])
+            try:
+                await asyncio.wait_for(future, ack_timeout)
+                return True
+            except asyncio.TimeoutError:
+                continue
+        return False
+
+    async def point_reached(self, timeout=None):
+        """
+        Waits for a point with an id greater than the one returned before. The point may have been reached before
+        the call, e.g. while `go_to_local_point` was being awaited
+        :return: id of the point, or None on timeout
+        """
+        if self.__point_id is None or (self.__prev_point_id is not None and self.__point_id <= self.__prev_point_id):
+            future = asyncio.get_running_loop().create_future()
+            self.__point_reached_futures.append(future)
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                return None
+        self.__prev_point_id = self.__point_id
+        return self.__prev_point_id
+
+
+async def _show_frame_rate(opts):
+    async with AsyncPioneer(opts.ip, logger=False) as pioneer:
+        time_start = time.monotonic()
+        n_frames = 0
+        async for frame in pioneer.frames():
+            n_frames += 1
+            pioneer.rc_channels(0, 0, 0, 0, 2)
+            if time.monotonic() - time_start >= opts.duration:
+                break
+        print('%d frames, %.1f fps, %d dropped' % (n_frames, n_frames / (time.monotonic() - time_start),
+                                                   pioneer.n_video_frames_dropped))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ip', type=str, default='192.168.4.1')
+    parser.add_argument('--duration', type=float, default=10., help='seconds')
+    asyncio.run(_show_frame_rate(parser.parse_args()))
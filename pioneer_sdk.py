@@ -1,24 +1,759 @@
-from pymavlink import mavutil
+from metrics import RollingStatistics
+import collections
+import concurrent.futures
+import importlib
+import queue
+import selectors
 import threading
 import socket
+import struct
 import sys
 import time
 
 
+class _LazyModule:
+    """
+    Imports a module on the first access to one of its attributes
+    """
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = importlib.import_module(self.__name)
+        return getattr(self.__module, attr)
+
+
+# pymavlink loads its message dialect on import, which takes longer than importing anything else here. Modules which
+# only need VideoFrame and the like, e.g. decoding workers, never pay for it
+mavutil = _LazyModule('pymavlink.mavutil')
+
+# Linux only, and not exported by the socket module. None where the kernel drop counter is not available
+SO_RXQ_OVFL = getattr(socket, 'SO_RXQ_OVFL', 40 if sys.platform.startswith('linux') else None)
+
+ACK_RESULTS = {  # MAV_RESULT: (name, outcome), outcome None means the command should be sent again
+    0: ('MAV_RESULT_ACCEPTED', True),
+    1: ('MAV_RESULT_TEMPORARILY_REJECTED', None),
+    2: ('MAV_RESULT_DENIED', True),
+    3: ('MAV_RESULT_UNSUPPORTED', False),
+    4: ('MAV_RESULT_FAILED', False),
+    5: ('MAV_RESULT_IN_PROGRESS', None),
+    6: ('MAV_RESULT_CANCELLED', None),
+}
+MAV_RESULT_IN_PROGRESS = 5
+
+
+def _completed_future(result):
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
+def rc_channels_values(roll, pitch, yaw, throttle, mode):
+    """
+    :param roll: [-1.0; 1.0]
+    :param pitch: [-1.0; 1.0]
+    :param yaw:  [-1.0; 1.0]
+    :param throttle: [-1.0; 1.0]
+    :param mode: 0, 1, or 2
+    :return: values of the 8 RC_CHANNELS_OVERRIDE channels
+    """
+    def normalize(rc):
+        return int(rc * 500 + 1500)
+
+    return normalize(throttle), normalize(-yaw), normalize(-pitch), normalize(roll), _RC_MODE_VALUES[int(mode)], 0, 0, 0
+
+
+_RC_MODE_VALUES = {0: 1000, 1: 1500, 2: 2000}
+
+
+def local_point_parameters(x=None, y=None, z=None, vx=None, vy=None, vz=None, afx=None, afy=None, afz=None,
+                           yaw=None, yaw_rate=None):
+    """
+    :return: SET_POSITION_TARGET_LOCAL_NED type mask ignoring the parameters which are None, dict of parameters
+    with the ignored ones set to 0
+    """
+    parameters = dict(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, afx=afx, afy=afy, afz=afz, force_set=0, yaw=yaw,
+                      yaw_rate=yaw_rate)  # 0-force_set
+    mask = 0b0000111111111111
+    element_mask = 0b0000000000000001
+    for n, v in parameters.items():
+        if v is not None:
+            mask = mask ^ element_mask
+        else:
+            parameters[n] = 0.0
+        element_mask = element_mask << 1
+    return mask, parameters
+
+
+def _x25_table():
+    table = []
+    for byte in range(256):
+        tmp = (byte ^ (byte << 4)) & 0xff
+        table.append(((tmp << 8) ^ (tmp << 3) ^ (tmp >> 4)) & 0xffff)
+    return table
+
+
+_X25_TABLE = _x25_table()
+
+
+def _x25_accumulate(crc, data):
+    """
+    CRC-16/MCRF4XX, the one MAVLink uses
+    """
+    table = _X25_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xff]
+    return crc
+
+
+class RcChannelsOverrideSender:
+    """
+    Sends RC_CHANNELS_OVERRIDE straight to the socket of a pymavlink `udpout` connection, bypassing the generic
+    encoder.
+
+    Until the channels or the target change, consecutive messages only differ by the sequence number, so the packet
+    is kept prebuilt and a send patches the sequence byte and the CRC. As the CRC is affine in the message bits, the
+    CRC of the packet is the one of the same packet with sequence 0 xored with a term which only depends on the
+    sequence number, the terms are precomputed. The sequence counter is the one of the connection, so the messages
+    stay in order with the ones sent through pymavlink.
+    """
+
+    HEADER = struct.Struct('<BBBBBB')  # Magic, payload length, sequence, system, component, message id
+    PAYLOAD = struct.Struct('<8HBB')  # Channels 1-8, target system, target component
+    CRC = struct.Struct('<H')
+    MAGIC = 0xfe  # MAVLink 1
+    MESSAGE_ID = 70
+    CRC_EXTRA = 124
+
+    def __init__(self, connection):
+        self.__mav = connection.mav
+        self.__socket = connection.port
+        self.__address = (socket.gethostbyname(connection.destination_addr[0]), connection.destination_addr[1])
+        self.__packet = bytearray(self.HEADER.size + self.PAYLOAD.size + self.CRC.size)
+        self.__crc_offset = self.HEADER.size + self.PAYLOAD.size
+        self.__key = None  # What the packet has been built for
+        self.__crc_seq_0 = 0
+        self.__crc_seq_terms = [self.__crc(seq) for seq in range(256)]
+        self.__crc_seq_terms = [term ^ self.__crc_seq_terms[0] for term in self.__crc_seq_terms]
+
+    @staticmethod
+    def supported(connection):
+        """
+        :return: True, if the connection sends MAVLink 1 to a single UDP address, without signing
+        """
+        return (isinstance(connection, mavutil.mavudp) and not connection.udp_server and
+                float(mavutil.mavlink.WIRE_PROTOCOL_VERSION) == 1. and not connection.mav.signing.sign_outgoing)
+
+    def __crc(self, seq):
+        self.__packet[2] = seq
+        crc = _x25_accumulate(0xffff, memoryview(self.__packet)[1:self.__crc_offset])
+        return _x25_accumulate(crc, (self.CRC_EXTRA,))
+
+    def __build(self, key):
+        target_system, target_component, channels = key
+        self.HEADER.pack_into(self.__packet, 0, self.MAGIC, self.PAYLOAD.size, 0, self.__mav.srcSystem,
+                              self.__mav.srcComponent, self.MESSAGE_ID)
+        self.PAYLOAD.pack_into(self.__packet, self.HEADER.size, *channels, target_system, target_component)
+        self.__crc_seq_0 = self.__crc(0)
+        self.__key = key
+
+    def send(self, target_system, target_component, channels):
+        """
+        :param channels: values of the 8 channels, see `rc_channels_values`
+        """
+        mav = self.__mav
+        key = (target_system, target_component, channels)
+        if key != self.__key:
+            self.__build(key)
+        packet = self.__packet
+        seq = mav.seq
+        packet[2] = seq
+        self.CRC.pack_into(packet, self.__crc_offset, self.__crc_seq_0 ^ self.__crc_seq_terms[seq])
+        try:
+            self.__socket.sendto(packet, self.__address)
+        except OSError:  # Same as pymavlink does
+            pass
+        mav.seq = (seq + 1) % 256
+        mav.total_packets_sent += 1
+        mav.total_bytes_sent += len(packet)
+
+
+class VideoFrame:
+    """
+    A received JPEG frame along with the data needed to measure its latency. `img` and `decode_duration` are filled
+    in by the consumer which decodes the frame.
+    """
+
+    __slots__ = ('data', 'seq', 'timestamp', 'size', 'img', 'decode_duration')
+
+    def __init__(self, data, seq=None, timestamp=None):
+        """
+        :param data: JPEG frame
+        :param seq: sequence number of the frame
+        :param timestamp: time.monotonic() the frame has been received at, now if None
+        """
+        self.data = data
+        self.seq = seq
+        self.timestamp = time.monotonic() if timestamp is None else timestamp
+        self.size = len(data)
+        self.img = None
+        self.decode_duration = None
+
+
+class VideoFrameBuffer:
+    """
+    Reassembles JPEG frames out of a stream of video datagrams.
+
+    Datagrams are received straight into a preallocated buffer, so no intermediate bytes objects are created. The
+    SOI / EOI marker search resumes from where the previous one stopped instead of rescanning the buffer from its
+    beginning. When the free space runs out, the unconsumed tail is moved to the front of the buffer.
+
+    Frames are handed out as VideoFrame records whose data is a memoryview into the buffer. A frame stays valid until
+    the next call to `drain`.
+    """
+
+    SOI = b'\xff\xd8'
+    EOI = b'\xff\xd9'
+
+    def __init__(self, capacity=1 << 20, max_datagram_size=65535, kernel_drops=False):
+        """
+        :param capacity: buffer size in bytes, should fit a few frames plus a datagram
+        :param max_datagram_size: free space that has to be available before each receive
+        :param kernel_drops: whether the socket has SO_RXQ_OVFL enabled, and the drop counter should be read
+        """
+        assert capacity > max_datagram_size
+        self.__buffer = bytearray(capacity)
+        self.__view = memoryview(self.__buffer)
+        self.__max_datagram_size = max_datagram_size
+        self.__ancillary_size = socket.CMSG_SPACE(4) if kernel_drops else 0
+        self.__end = 0  # End of the received data
+        self.__scan = 0  # Position the marker search resumes from
+        self.__frame_start = -1  # SOI offset of the frame being assembled, -1 if none
+        self.__frames = collections.deque()  # Frames which have not been handed out, (begin, end, seq, timestamp)
+        self.__receive_time = None  # When the last batch of datagrams has been received
+        self.n_frames = 0
+        self.n_frames_dropped = 0  # Incomplete frames: overflowing the buffer, or missing datagrams with SOI or EOI
+        self.n_frames_skipped = 0  # Complete frames superseded by a newer one, see `latest_frame`
+        self.n_datagrams = 0
+        # Datagrams discarded by the kernel, as reported by SO_RXQ_OVFL. None if unknown
+        self.n_datagrams_dropped = 0 if kernel_drops else None
+        self.n_bytes = 0
+        self.n_bytes_skipped = 0  # Received outside of any frame, e.g. the rest of a frame which has lost its SOI
+        # Called with every complete frame as it is found, before any is skipped, e.g. `VideoRecorder.record`. The
+        # frame's data is only valid during the call
+        self.frame_callback = None
+
+    def __compact(self):
+        if self.__frames:
+            start = self.__frames[0][0]
+        elif self.__frame_start != -1:
+            start = self.__frame_start
+        else:
+            start = self.__scan
+        n_bytes = self.__end - start
+        self.__view[:n_bytes] = self.__view[start:self.__end]
+        self.__end = n_bytes
+        self.__scan -= start
+        if self.__frame_start != -1:
+            self.__frame_start -= start
+        for _ in range(len(self.__frames)):
+            begin, end, seq, timestamp = self.__frames.popleft()
+            self.__frames.append((begin - start, end - start, seq, timestamp))
+
+    def __reserve(self):
+        """
+        Makes sure there is enough free space for a datagram
+        :return: False, if the space is occupied by complete frames which have not been handed out yet
+        """
+        if len(self.__buffer) - self.__end >= self.__max_datagram_size:
+            return True
+        self.__scan_frames()
+        self.__compact()
+        if len(self.__buffer) - self.__end >= self.__max_datagram_size:
+            return True
+        if self.__frames:
+            return False
+        # The frame being assembled does not fit, drop it
+        self.n_frames_dropped += 1
+        self.__end = self.__scan = 0
+        self.__frame_start = -1
+        return True
+
+    def __scan_frames(self):
+        while True:
+            if self.__frame_start == -1:
+                beginning = self.__buffer.find(VideoFrameBuffer.SOI, self.__scan, self.__end)
+                # Tails of frames which have lost their beginning, SOI included
+                self.n_frames_dropped += self.__buffer.count(VideoFrameBuffer.EOI, self.__scan,
+                                                             beginning if beginning != -1 else self.__end)
+                if beginning == -1:
+                    # Whatever is there is not a part of a frame. Keep the last byte, it might be a half of SOI
+                    scan = max(self.__scan, self.__end - 1)
+                    self.n_bytes_skipped += scan - self.__scan
+                    self.__scan = scan
+                    return
+                self.n_bytes_skipped += beginning - self.__scan
+                self.__frame_start = beginning
+                self.__scan = beginning + len(VideoFrameBuffer.SOI)
+
+            end = self.__buffer.find(VideoFrameBuffer.EOI, self.__scan, self.__end)
+            restart = self.__buffer.find(VideoFrameBuffer.SOI, self.__scan, end if end != -1 else self.__end)
+            if restart != -1:
+                # The next frame begins before this one has ended, the end of this one, EOI included, has been lost
+                self.n_frames_dropped += 1
+                self.__frame_start = restart
+                self.__scan = restart + len(VideoFrameBuffer.SOI)
+                continue
+            if end == -1:
+                self.__scan = max(self.__scan, self.__end - 1)
+                return
+
+            end += len(VideoFrameBuffer.EOI)
+            self.n_frames += 1
+            self.__frames.append((self.__frame_start, end, self.n_frames, self.__receive_time))
+            if self.frame_callback is not None:
+                self.frame_callback(VideoFrame(self.__view[self.__frame_start:end], self.n_frames, self.__receive_time))
+            self.__scan = end
+            self.__frame_start = -1
+
+    def drain(self, sock):
+        """
+        Receives datagrams pending on a non-blocking socket until there are none left, or the buffer is full of
+        frames which have not been handed out
+        :return: number of datagrams received
+        """
+        n_datagrams = 0
+        while self.__reserve():
+            receive_view = self.__view[self.__end:self.__end + self.__max_datagram_size]
+            try:
+                if self.__ancillary_size:
+                    n_bytes, ancillary, _, _ = sock.recvmsg_into((receive_view,), self.__ancillary_size)
+                    for level, kind, data in ancillary:
+                        if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(data) >= 4:
+                            self.n_datagrams_dropped = int.from_bytes(data[:4], sys.byteorder)
+                else:
+                    n_bytes = sock.recv_into(receive_view)
+            except BlockingIOError:
+                break
+            finally:
+                receive_view.release()
+            self.__end += n_bytes
+            self.n_bytes += n_bytes
+            n_datagrams += 1
+        if n_datagrams:
+            self.__receive_time = time.monotonic()
+            self.n_datagrams += n_datagrams
+        return n_datagrams
+
+    def feed(self, data):
+        """
+        Copies a datagram received elsewhere into the buffer, e.g. by an asyncio protocol
+        :return: False, if the datagram has been dropped as the buffer is full of frames which have not been handed out
+        """
+        n_bytes = len(data)
+        if n_bytes > self.__max_datagram_size or not self.__reserve():
+            return False
+        self.__view[self.__end:self.__end + n_bytes] = data
+        self.__end += n_bytes
+        self.n_bytes += n_bytes
+        self.n_datagrams += 1
+        self.__receive_time = time.monotonic()
+        return True
+
+    def __pop_frame(self):
+        begin, end, seq, timestamp = self.__frames.popleft()
+        return VideoFrame(self.__view[begin:end], seq, timestamp)
+
+    def next_frame(self):
+        """
+        :return: the oldest complete frame which has not been handed out, or None
+        """
+        self.__scan_frames()
+        if not self.__frames:
+            return None
+        return self.__pop_frame()
+
+    def latest_frame(self):
+        """
+        Skips complete frames which have been superseded by a newer one
+        :return: the newest complete frame, or None
+        """
+        self.__scan_frames()
+        if not self.__frames:
+            return None
+        while len(self.__frames) > 1:
+            self.__frames.popleft()
+            self.n_frames_skipped += 1
+        return self.__pop_frame()
+
+
+class FrameMailbox:
+    """
+    Single-slot mailbox handing frames over from a producer thread. A published frame replaces the one which has not
+    been taken yet, so a consumer always gets the freshest frame available.
+    """
+
+    def __init__(self):
+        self.__condition = threading.Condition()
+        self.__frame = None
+        self.__seq = 0
+        self.n_dropped = 0
+
+    def publish(self, frame):
+        with self.__condition:
+            if self.__frame is not None:
+                self.n_dropped += 1
+            self.__frame = frame
+            self.__seq += 1
+            self.__condition.notify_all()
+
+    def take(self, timeout=None):
+        """
+        Waits for a frame which has not been taken yet
+        :return: (frame, sequence number, number of frames dropped so far), or None on timeout
+        """
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.__frame is not None, timeout):
+                return None
+            frame, self.__frame = self.__frame, None
+            return frame, self.__seq, self.n_dropped
+
+
+class MavlinkReader:
+    """
+    The only reader of a mavlink connection. Every incoming message is parsed once, kept as the latest message of its
+    type along with its receive time, and, for the types listed in `queued_types`, put into a queue of its own. So
+    whoever waits for a message of one type never consumes messages of another one.
+
+    The latest messages and the rates they arrive at are only written by the reader thread, and each one is replaced
+    as a whole, so `latest` and `rate` read them without locking.
+    """
+
+    RATE_SMOOTHING = .1  # Weight of the last interval in the moving average of intervals
+
+    def __init__(self, connection, queued_types=('MISSION_ITEM_REACHED', 'POSITION_TARGET_LOCAL_NED'),
+                 queue_size=16):
+        """
+        :param queue_size: a queue holds this many messages, the oldest ones get dropped
+        """
+        self.__connection = connection
+        self.__latest = {}  # Message type: (message, time.monotonic() it has been received at)
+        self.__intervals = {}  # Message type: moving average of the time between messages, seconds
+        self.__queues = {message_type: queue.Queue(queue_size) for message_type in queued_types}
+        self.__callbacks = collections.defaultdict(list)  # Message type: [callback(message)]
+        self.__condition = threading.Condition()
+        self.__thread = threading.Thread(target=self.__read_task)
+        self.__thread.daemon = True
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def subscribe(self, message_type, callback):
+        """
+        :param callback: called with every message of the type, from the reader thread
+        """
+        self.__callbacks[message_type].append(callback)
+
+    def __read_task(self):
+        while True:
+            message = self.__connection.recv_match(blocking=True, timeout=1)
+            if message is None:
+                continue
+            message_type = message.get_type()
+            if message_type == 'BAD_DATA':
+                if mavutil.all_printable(message.data):
+                    sys.stdout.write(message.data)
+                    sys.stdout.flush()
+                continue
+
+            now = time.monotonic()
+            _, time_previous = self.__latest.get(message_type, (None, None))
+            if time_previous is not None:
+                interval = self.__intervals.get(message_type)
+                self.__intervals[message_type] = now - time_previous if interval is None else \
+                    interval + (now - time_previous - interval) * self.RATE_SMOOTHING
+            with self.__condition:
+                self.__latest[message_type] = (message, now)
+                self.__condition.notify_all()
+            for callback in self.__callbacks.get(message_type, ()):
+                callback(message)
+            message_queue = self.__queues.get(message_type)
+            if message_queue is not None:
+                while True:
+                    try:
+                        message_queue.put_nowait(message)
+                        break
+                    except queue.Full:
+                        try:
+                            message_queue.get_nowait()
+                        except queue.Empty:
+                            pass
+
+    def latest(self, message_type):
+        """
+        :return: (latest message of the type, time.monotonic() it has been received at), (None, None) if there has
+        been none
+        """
+        return self.__latest.get(message_type, (None, None))
+
+    def rate(self, message_type):
+        """
+        :return: rate messages of the type arrive at, Hz, None if less than two have been received
+        """
+        interval = self.__intervals.get(message_type)
+        return 1. / interval if interval else None
+
+    def wait_latest(self, message_type, timeout=None, newer_than=None):
+        """
+        Waits for a message of the type received after `newer_than`, now if None
+        :return: message, or None on timeout
+        """
+        if newer_than is None:
+            newer_than = time.monotonic()
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.latest(message_type)[1] is not None and
+                                             self.latest(message_type)[1] > newer_than, timeout):
+                return None
+            return self.latest(message_type)[0]
+
+    def get(self, message_type, timeout=None):
+        """
+        Takes the oldest queued message of the type
+        :param timeout: 0 to return right away
+        :return: message, or None on timeout
+        """
+        try:
+            if timeout == 0:
+                return self.__queues[message_type].get_nowait()
+            return self.__queues[message_type].get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def clear(self, message_type):
+        """
+        Drops the queued messages of the type
+        """
+        while self.get(message_type, 0) is not None:
+            pass
+
+
+class CommandDispatcher:
+    """
+    Sends COMMAND_LONG messages and matches the COMMAND_ACKs to them, from a thread of its own. Callers get futures,
+    so nobody blocks on the link. Commands of different kinds may be in flight at the same time, the ones of the same
+    kind are sent one after another, since an ack only tells which kind of command it is for.
+    """
+
+    class _Command:
+        __slots__ = ('command', 'params', 'target_component', 'future', 'n_sent', 'deadline', 'time_sent')
+
+        def __init__(self, command, params, target_component):
+            self.command = command
+            self.params = params
+            self.target_component = target_component
+            self.future = concurrent.futures.Future()
+            self.n_sent = 0
+            self.deadline = None  # When to send the command (again)
+            self.time_sent = None  # When the command has been sent first, None once its round trip time is known
+
+    def __init__(self, connection, ack_timeout=1., n_retries=5, backoff=1.5, logger=True, rtt=None):
+        """
+        :param ack_timeout: time to wait for the first ack
+        :param n_retries: number of times a command is sent again before giving up
+        :param backoff: the time to wait for an ack gets multiplied by it on every retry
+        :param rtt: RollingStatistics to add the round trip times of the commands to. Only the commands acked before
+        being sent again count, as it is unknown which one of the sends a later ack is for
+        """
+        self.__connection = connection
+        self.__rtt = rtt
+        self.ack_timeout = ack_timeout
+        self.n_retries = n_retries
+        self.backoff = backoff
+        self.__logger = logger
+        self.__condition = threading.Condition()
+        self.__commands = collections.defaultdict(collections.deque)  # MAV_CMD: commands, the first one is in flight
+        self.__thread = threading.Thread(target=self.__dispatch_task)
+        self.__thread.daemon = True
+
+    def start(self):
+        self.__thread.start()
+        return self
+
+    def submit(self, command, params=(), target_component=None):
+        """
+        :param params: up to 7 COMMAND_LONG parameters
+        :param target_component: component of the target system, the one of the connection if None
+        :return: concurrent.futures.Future. Its result is True if the command has been accepted, False if it has been
+        refused or has not been acknowledged after all the retries
+        """
+        params = tuple(params) + (0,) * (7 - len(params))
+        pending = CommandDispatcher._Command(command, params, target_component)
+        with self.__condition:
+            self.__commands[command].append(pending)
+            self.__condition.notify()
+        return pending.future
+
+    def on_ack(self, ack):
+        """
+        Should be subscribed to COMMAND_ACK
+        """
+        with self.__condition:
+            commands = self.__commands.get(ack.command)
+            if not commands or commands[0].n_sent == 0:
+                return
+            pending = commands[0]
+            if self.__rtt is not None and pending.n_sent == 1 and pending.time_sent is not None:
+                self.__rtt.add(time.monotonic() - pending.time_sent)
+            pending.time_sent = None
+            name, outcome = ACK_RESULTS.get(ack.result, ('MAV_RESULT %d' % ack.result, False))
+            if self.__logger:
+                print(name)
+            if ack.result == MAV_RESULT_IN_PROGRESS:  # Wait for the final ack without sending the command again
+                pending.deadline = time.monotonic() + self.__timeout(pending)
+            elif outcome is None:
+                pending.deadline = time.monotonic()
+            else:
+                commands.popleft()
+            self.__condition.notify()
+        if outcome is not None:
+            pending.future.set_result(outcome)
+
+    def __timeout(self, pending):
+        return self.ack_timeout * self.backoff ** max(pending.n_sent - 1, 0)
+
+    def __send(self, pending):
+        target_component = pending.target_component
+        if target_component is None:
+            target_component = self.__connection.target_component
+        self.__connection.mav.command_long_send(self.__connection.target_system, target_component, pending.command,
+                                                pending.n_sent,  # confirmation
+                                                *pending.params)
+        if pending.n_sent == 0:
+            pending.time_sent = time.monotonic()
+        pending.n_sent += 1
+        pending.deadline = time.monotonic() + self.__timeout(pending)
+
+    def __dispatch_task(self):
+        while True:
+            expired = []
+            with self.__condition:
+                now = time.monotonic()
+                next_deadline = None
+                for commands in self.__commands.values():
+                    while commands and commands[0].n_sent > self.n_retries and commands[0].deadline <= now:
+                        expired.append(commands.popleft())
+                    if not commands:
+                        continue
+                    pending = commands[0]
+                    if pending.deadline is None or pending.deadline <= now:
+                        self.__send(pending)
+                    if next_deadline is None or pending.deadline < next_deadline:
+                        next_deadline = pending.deadline
+                if not expired:
+                    self.__condition.wait(next_deadline - now if next_deadline is not None else None)
+            for pending in expired:
+                if self.__logger:
+                    print('command %d has not been acknowledged' % pending.command)
+                pending.future.set_result(False)
+
+
+class LinkMonitor:
+    """
+    Rolling statistics of the link to the vehicle, to tell link problems apart from processing ones. Timings are
+    kept per event. Rates and loss are computed from counters sampled over periods of at least `period` seconds.
+    """
+
+    def __init__(self, period=1., n_periods=60):
+        self.period = period
+        self.command_rtt = RollingStatistics()  # Seconds
+        self.heartbeat_interval = RollingStatistics()  # Seconds between heartbeats of the vehicle
+        self.mavlink_loss = RollingStatistics(n_periods)  # Share of MAVLink messages lost, by the sequence numbers
+        self.video_frame_rate = RollingStatistics(n_periods)  # Complete frames per second
+        self.video_throughput = RollingStatistics(n_periods)  # Bytes per second
+        self.video_incomplete_frames = RollingStatistics(n_periods)  # Incomplete frames per second
+        self.__time_heartbeat = None
+        self.__samples = {}  # Name: (time.monotonic(), counters) sampled last
+
+    def __sample(self, name, counters, now):
+        """
+        :return: per second increments of the counters since the last sample, None if the period is not over yet
+        """
+        previous = self.__samples.get(name)
+        if previous is not None and now - previous[0] < self.period:
+            return None
+        self.__samples[name] = (now, counters)
+        if previous is None:
+            return None
+        return [(counter - counter_previous) / (now - previous[0])
+                for counter, counter_previous in zip(counters, previous[1])]
+
+    def on_heartbeat(self, now=None):
+        now = time.monotonic() if now is None else now
+        if self.__time_heartbeat is not None:
+            self.heartbeat_interval.add(now - self.__time_heartbeat)
+        self.__time_heartbeat = now
+
+    def sample_mavlink(self, n_received, n_lost, now=None):
+        rates = self.__sample('mavlink', (n_received, n_lost), time.monotonic() if now is None else now)
+        if rates is not None and sum(rates) > 0:
+            received, lost = rates
+            self.mavlink_loss.add(lost / (received + lost))
+
+    def sample_video(self, video_frame_buffer, now=None):
+        rates = self.__sample('video', (video_frame_buffer.n_frames, video_frame_buffer.n_bytes,
+                                        video_frame_buffer.n_frames_dropped),
+                              time.monotonic() if now is None else now)
+        if rates is not None:
+            frame_rate, throughput, incomplete_frames = rates
+            self.video_frame_rate.add(frame_rate)
+            self.video_throughput.add(throughput)
+            self.video_incomplete_frames.add(incomplete_frames)
+
+    def summary(self):
+        """
+        :return: dict of `RollingStatistics.summary` of each of the statistics
+        """
+        return dict(command_rtt=self.command_rtt.summary(), heartbeat_interval=self.heartbeat_interval.summary(),
+                    mavlink_loss=self.mavlink_loss.summary(), video_frame_rate=self.video_frame_rate.summary(),
+                    video_throughput=self.video_throughput.summary(),
+                    video_incomplete_frames=self.video_incomplete_frames.summary())
+
+
 class Pioneer:
     def __init__(self, pioneer_ip='192.168.4.1', pioneer_video_port=8888, pioneer_video_control_port=8888,
-                 pioneer_mavlink_port=8001, logger=True):
+                 pioneer_mavlink_port=8001, logger=True, video_receiver_thread=False, video_socket_buffer=4 << 20):
+        """
+        :param video_receiver_thread: start the video receiver thread right away, see `start_video_receiver`
+        :param video_socket_buffer: requested SO_RCVBUF of the video socket. The kernel caps it at net.core.rmem_max
+        """
         self.__VIDEO_BUFFER = 65535
+        self.__video_timeout = 5
         video_control_address = (pioneer_ip, pioneer_video_control_port)
         self.__video_control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.__video_control_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.__video_control_socket.settimeout(5)
         self.__video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.__video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.__video_socket.settimeout(5)
+        self.__video_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, video_socket_buffer)
+        self.__video_socket.setblocking(False)
+        self.__video_selector = selectors.DefaultSelector()
+        self.__video_selector.register(self.__video_socket, selectors.EVENT_READ)
+        kernel_drops = False
+        if SO_RXQ_OVFL is not None:
+            try:
+                self.__video_socket.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+                kernel_drops = True
+            except OSError:
+                pass
 
-        self.__video_frame_buffer = bytes()
-        self.__raw_video_frame = 0
+        self.__video_frame_buffer = VideoFrameBuffer(max_datagram_size=self.__VIDEO_BUFFER, kernel_drops=kernel_drops)
+        self.__video_kernel_drops = 0
+        self.__video_mailbox = FrameMailbox()
+        self.__video_receiver_thread = None
         self.__heartbeat_send_delay = 1
         self.__ack_timeout = 1
         self.__logger = logger
@@ -33,6 +768,19 @@ class Pioneer:
             print('Can not connect to pioneer. Do you connect to drone wifi?')
             sys.exit()
 
+        if RcChannelsOverrideSender.supported(self.__mavlink_socket):
+            self.__rc_sender = RcChannelsOverrideSender(self.__mavlink_socket)
+        else:
+            self.__rc_sender = None
+
+        self.__link_monitor = LinkMonitor()
+        self.__command_dispatcher = CommandDispatcher(self.__mavlink_socket, self.__ack_timeout, logger=logger,
+                                                      rtt=self.__link_monitor.command_rtt).start()
+        self.__mavlink_reader = MavlinkReader(self.__mavlink_socket)
+        self.__mavlink_reader.subscribe('COMMAND_ACK', self.__command_dispatcher.on_ack)
+        self.__mavlink_reader.subscribe('HEARTBEAT', self.__on_heartbeat)
+        self.__mavlink_reader.start()
+
         self.__init_heartbeat_event = threading.Event()
 
         self.__heartbeat_thread = threading.Thread(target=self.__heartbeat_handler,
@@ -40,27 +788,115 @@ class Pioneer:
         self.__heartbeat_thread.daemon = True
         self.__heartbeat_thread.start()
 
-        while not self.__init_heartbeat_event.is_set():
-            pass
+        self.__init_heartbeat_event.wait()
 
-        while not self.point_reached():
+        while not self.point_reached(blocking=True):
             pass
 
+        if self.__logger:
+            print('video socket buffer: %d bytes' % self.__video_socket.getsockopt(socket.SOL_SOCKET,
+                                                                                   socket.SO_RCVBUF))
+
+        if video_receiver_thread:
+            self.start_video_receiver()
+
+    def start_video_receiver(self):
+        """
+        Starts a thread which keeps draining the video socket. Only the newest complete frame is kept, so consumers
+        get fresh frames instead of the ones which have piled up in the socket buffer.
+        """
+        if self.__video_receiver_thread is not None:
+            return
+        self.__video_receiver_thread = threading.Thread(target=self.__video_receiver_handler)
+        self.__video_receiver_thread.daemon = True
+        self.__video_receiver_thread.start()
+
+    def __video_receiver_handler(self):
+        while True:
+            frame = self.__receive_video_frame(latest=True)
+            if frame is not None:
+                frame.data = bytes(frame.data)
+                self.__video_mailbox.publish(frame)
+
+    def record_video(self, recorder):
+        """
+        Records every complete frame as it is received, including the ones consumers skip or never take, so a replay
+        reproduces the stream as received
+        :param recorder: `video_record.VideoRecorder`, None to stop recording
+        """
+        self.__video_frame_buffer.frame_callback = recorder.record if recorder is not None else None
+
+    def get_latest_video_frame(self, timeout=None):
+        """
+        Requires the video receiver thread to be running
+        :return: (VideoFrame, sequence number, number of frames dropped so far), or None on timeout
+        """
+        return self.__video_mailbox.take(timeout)
+
+    def get_video_frame(self):
+        """
+        :return: VideoFrame, or None on failure. Unless the video receiver thread is running, its data is a
+        memoryview which is only valid until the next call, copy it if it has to be kept
+        """
+        if self.__video_receiver_thread is not None:
+            received = self.__video_mailbox.take(self.__video_timeout)
+            return received[0] if received is not None else None
+        return self.__receive_video_frame()
+
     def get_raw_video_frame(self):
+        """
+        :return: JPEG frame, see `get_video_frame`
+        """
+        frame = self.get_video_frame()
+        return frame.data if frame is not None else None
+
+    def get_video_statistics(self):
+        """
+        :return: dict of video receive counters
+        """
+        video_frame_buffer = self.__video_frame_buffer
+        return dict(frames=video_frame_buffer.n_frames, frames_dropped=video_frame_buffer.n_frames_dropped,
+                    frames_skipped=video_frame_buffer.n_frames_skipped, datagrams=video_frame_buffer.n_datagrams,
+                    datagrams_dropped=video_frame_buffer.n_datagrams_dropped, bytes=video_frame_buffer.n_bytes,
+                    bytes_skipped=video_frame_buffer.n_bytes_skipped)
+
+    def get_command_rtt(self):
+        """
+        :return: median command round trip time over the recent commands, seconds, or None if none has been
+        acknowledged yet
+        """
+        return self.__link_monitor.command_rtt.summary().get('p50')
+
+    def get_link_statistics(self):
+        """
+        :return: dict of rolling statistics of the link, see `LinkMonitor.summary`
+        """
+        return self.__link_monitor.summary()
+
+    def __on_heartbeat(self, message):
+        self.__link_monitor.on_heartbeat()
+        self.__link_monitor.sample_mavlink(self.__mavlink_socket.mav_count, self.__mavlink_socket.mav_loss)
+
+    def __receive_video_frame(self, latest=False):
+        """
+        Drains every pending datagram on each wakeup
+        :param latest: skip complete frames superseded by a newer one
+        """
+        video_frame_buffer = self.__video_frame_buffer
         try:
             while True:
-                self.__video_frame_buffer += self.__video_socket.recv(self.__VIDEO_BUFFER)
-                beginning = self.__video_frame_buffer.find(b'\xff\xd8')
-                end = self.__video_frame_buffer.find(b'\xff\xd9')
-                if beginning != -1 and end != -1 and end > beginning:
-                    self.__raw_video_frame = self.__video_frame_buffer[beginning:end + 2]
-                    self.__video_frame_buffer = self.__video_frame_buffer[end + 2:]
-                    break
-                else:
-                    print(len(self.__raw_video_frame))
-                    self.__video_frame_buffer = bytes()
-                    self.__raw_video_frame = bytes()
-            return self.__raw_video_frame
+                frame = video_frame_buffer.latest_frame() if latest else video_frame_buffer.next_frame()
+                if frame is not None:
+                    return frame
+                if not self.__video_selector.select(self.__video_timeout):
+                    raise socket.timeout('timed out')
+                video_frame_buffer.drain(self.__video_socket)
+                self.__link_monitor.sample_video(video_frame_buffer)
+                if video_frame_buffer.n_datagrams_dropped not in (None, self.__video_kernel_drops):
+                    if self.__logger:
+                        print('video datagrams dropped by the kernel: %d' % (video_frame_buffer.n_datagrams_dropped -
+                                                                             self.__video_kernel_drops))
+                    self.__video_kernel_drops = video_frame_buffer.n_datagrams_dropped
         except socket.error as exc:
             print('Caught exception socket.error : ', exc)
 
@@ -71,7 +907,8 @@ class Pioneer:
             print('send heartbeat')
 
     def __receive_heartbeat(self):
-        self.__mavlink_socket.wait_heartbeat()
+        while self.__mavlink_reader.wait_latest('HEARTBEAT') is None:
+            pass
         if self.__logger:
             print("Heartbeat from system (system %u component %u)" % (self.__mavlink_socket.target_system,
                                                                       self.__mavlink_socket.target_component))
@@ -84,190 +921,74 @@ class Pioneer:
                 event.set()
             time.sleep(self.__heartbeat_send_delay)
 
-    def __get_ack(self):
-        command_ack = self.__mavlink_socket.recv_match(type='COMMAND_ACK', blocking=True,
-                                                       timeout=self.__ack_timeout)
-        if command_ack is not None:
-            if command_ack.get_type() == 'COMMAND_ACK':
-                if command_ack.result == 0:  # MAV_RESULT_ACCEPTED
-                    if self.__logger:
-                        print('MAV_RESULT_ACCEPTED')
-                    return True
-                elif command_ack.result == 1:  # MAV_RESULT_TEMPORARILY_REJECTED
-                    if self.__logger:
-                        print('MAV_RESULT_TEMPORARILY_REJECTED')
-                    return None
-                elif command_ack.result == 2:  # MAV_RESULT_DENIED
-                    if self.__logger:
-                        print('MAV_RESULT_DENIED')
-                    return True
-                elif command_ack.result == 3:  # MAV_RESULT_UNSUPPORTED
-                    if self.__logger:
-                        print('MAV_RESULT_UNSUPPORTED')
-                    return False
-                elif command_ack.result == 4:  # MAV_RESULT_FAILED
-                    if self.__logger:
-                        print('MAV_RESULT_FAILED')
-                    return False
-                elif command_ack.result == 5:  # MAV_RESULT_IN_PROGRESS
-                    if self.__logger:
-                        print('MAV_RESULT_IN_PROGRESS')
-                    return self.__get_ack()
-                elif command_ack.result == 6:  # MAV_RESULT_CANCELLED
-                    if self.__logger:
-                        print('MAV_RESULT_CANCELLED')
-                    return None
-        else:
-            return None
+    def send_command(self, command, param1=0, param2=0, param3=0, param4=0, param5=0, param6=0, param7=0,
+                     target_component=None, description=None):
+        """
+        Sends COMMAND_LONG through the command dispatcher, see `CommandDispatcher.submit`
+        :param description: what to log once the command is accepted
+        :return: concurrent.futures.Future
+        """
+        future = self.__command_dispatcher.submit(command, (param1, param2, param3, param4, param5, param6, param7),
+                                                  target_component)
+        if self.__logger and description is not None:
+            future.add_done_callback(lambda f: print(description) if f.result() else None)
+        return future
 
     def arm(self):
-        i = 0
+        """
+        Disarms, if arming gets refused
+        :return: concurrent.futures.Future, its result is True if the vehicle has been armed
+        """
         if self.__logger:
             print('arm command send')
-        while True:
-            self.__mavlink_socket.mav.command_long_send(
-                self.__mavlink_socket.target_system,  # target_system
-                self.__mavlink_socket.target_component,
-                mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM,  # command
-                i,  # confirmation
-                1,  # param1
-                0,  # param2 (all other params meaningless)
-                0,  # param3
-                0,  # param4
-                0,  # param5
-                0,  # param6
-                0)  # param7
-            ack = self.__get_ack()
-            if ack is not None:
-                if ack:
-                    if self.__logger:
-                        print('arming complete')
-                    break
-                else:
-                    self.disarm()
-                    sys.exit()
-            else:
-                i += 1
+        future = self.send_command(mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 1, description='arming complete')
+        future.add_done_callback(lambda f: self.disarm() if not f.result() else None)
+        return future
 
     def disarm(self):
-        i = 0
+        """
+        :return: concurrent.futures.Future, its result is True if the vehicle has been disarmed
+        """
         if self.__logger:
             print('disarm command send')
-        while True:
-            self.__mavlink_socket.mav.command_long_send(
-                self.__mavlink_socket.target_system,  # target_system
-                self.__mavlink_socket.target_component,
-                mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM,  # command
-                i,  # confirmation
-                0,  # param1
-                0,  # param2 (all other params meaningless)
-                0,  # param3
-                0,  # param4
-                0,  # param5
-                0,  # param6
-                0)  # param7
-            ack = self.__get_ack()
-            if ack is not None:
-                if ack:
-                    if self.__logger:
-                        print('disarming complete')
-                    break
-                else:
-                    self.disarm()
-            else:
-                i += 1
+        return self.send_command(mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 0, description='disarming complete')
 
     def takeoff(self):
-        i = 0
+        """
+        Lands, if taking off gets refused
+        :return: concurrent.futures.Future, its result is True if taking off has been accepted
+        """
         if self.__logger:
             print('takeoff command send')
-        while True:
-            self.__mavlink_socket.mav.command_long_send(
-                self.__mavlink_socket.target_system,  # target_system
-                self.__mavlink_socket.target_component,
-                mavutil.mavlink.MAV_CMD_NAV_TAKEOFF,  # command
-                i,  # confirmation
-                0,  # param1
-                0,  # param2
-                0,  # param3
-                0,  # param4
-                0,  # param5
-                0,  # param6
-                0)  # param7
-            ack = self.__get_ack()
-            if ack is not None:
-                if ack:
-                    if self.__logger:
-                        print('takeoff complete')
-                    break
-                else:
-                    self.land()
-                    sys.exit()
-            else:
-                i += 1
+        future = self.send_command(mavutil.mavlink.MAV_CMD_NAV_TAKEOFF, description='takeoff complete')
+        future.add_done_callback(lambda f: self.land() if not f.result() else None)
+        return future
 
     def land(self):
-        i = 0
+        """
+        :return: concurrent.futures.Future, its result is True if landing has been accepted
+        """
         if self.__logger:
             print('land command send')
-        while True:
-            self.__mavlink_socket.mav.command_long_send(
-                self.__mavlink_socket.target_system,  # target_system
-                self.__mavlink_socket.target_component,
-                mavutil.mavlink.MAV_CMD_NAV_LAND,  # command
-                i,  # confirmation
-                0,  # param1
-                0,  # param2
-                0,  # param3
-                0,  # param4
-                0,  # param5
-                0,  # param6
-                0)  # param7
-            ack = self.__get_ack()
-            if ack is not None:
-                if ack:
-                    if self.__logger:
-                        print('landing complete')
-                    break
-                else:
-                    self.land()
-            else:
-                i += 1
+        return self.send_command(mavutil.mavlink.MAV_CMD_NAV_LAND, description='landing complete')
 
     def lua_script_control(self, input_state='Stop'):
-        i = 0
+        """
+        :return: concurrent.futures.Future, its result is True if the command has been accepted
+        """
         target_component = 25
         state = dict(Stop=0, Start=1)
         command = state.get(input_state)
         if command is not None:
             if self.__logger:
                 print('LUA script command: %s send' % input_state)
-            while True:
-                self.__mavlink_socket.mav.command_long_send(
-                    self.__mavlink_socket.target_system,  # target_system
-                    target_component,
-                    mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM,  # command
-                    i,  # confirmation
-                    command,  # param1
-                    0,  # param2
-                    0,  # param3
-                    0,  # param4
-                    0,  # param5
-                    0,  # param6
-                    0)  # param7
-                ack = self.__get_ack()
-                if ack is not None:
-                    if ack:
-                        if self.__logger:
-                            print('LUA script command: %s complete' % input_state)
-                        break
-                    else:
-                        i += 1
-                else:
-                    i += 1
+            return self.send_command(mavutil.mavlink.MAV_CMD_COMPONENT_ARM_DISARM, command,
+                                     target_component=target_component,
+                                     description='LUA script command: %s complete' % input_state)
         else:
             if self.__logger:
                 print('wrong LUA command value')
+            return _completed_future(False)
 
     def rc_channels(self, roll, pitch, yaw, throttle, mode):
         """
@@ -277,24 +998,22 @@ class Pioneer:
         :param throttle: [-1.0; 1.0]
         :return:
         """
-        def normalize(rc):
-            return int(rc * 500 + 1500)
-
-        mode_convert = {0: int(1000), 1: int(1500), 2: int(2000)}
-
-        roll = normalize(roll)
-        pitch = normalize(-pitch)
-        yaw = normalize(-yaw)
-        throttle = normalize(throttle)
-        mode = mode_convert[int(mode)]
-        self.__mavlink_socket.mav.rc_channels_override_send(self.__mavlink_socket.target_system, self.__mavlink_socket.target_component, throttle, yaw, pitch, roll, mode, 0, 0, 0)
+        if self.__rc_sender is not None:
+            self.__rc_sender.send(self.__mavlink_socket.target_system, self.__mavlink_socket.target_component,
+                                  rc_channels_values(roll, pitch, yaw, throttle, mode))
+        else:
+            self.__mavlink_socket.mav.rc_channels_override_send(self.__mavlink_socket.target_system,
+                                                                self.__mavlink_socket.target_component,
+                                                                *rc_channels_values(roll, pitch, yaw, throttle, mode))
 
     def led_control(self, led_id=255, r=0, g=0, b=0):  # 255 all led
+        """
+        :return: concurrent.futures.Future, its result is True if the command has been accepted
+        """
         max_value = 255.0
         all_led = 255
         first_led = 0
         last_led = 3
-        i = 0
         led_value = [r, g, b]
         command = True
 
@@ -317,47 +1036,19 @@ class Pioneer:
                 led_id_print = led_id
             if self.__logger:
                 print('LED id: %s R: %i ,G: %i, B: %i send' % (led_id_print, r, g, b))
-            while True:
-                self.__mavlink_socket.mav.command_long_send(
-                    self.__mavlink_socket.target_system,  # target_system
-                    self.__mavlink_socket.target_component,
-                    mavutil.mavlink.MAV_CMD_USER_1,  # command
-                    i,  # confirmation
-                    led_id,  # param1
-                    led_value[0],  # param2
-                    led_value[1],  # param3
-                    led_value[2],  # param4
-                    0,  # param5
-                    0,  # param6
-                    0)  # param7
-                ack = self.__get_ack()
-                if ack is not None:
-                    if ack:
-                        if self.__logger:
-                            print('LED id: %s RGB send complete' % led_id_print)
-                        break
-                    else:
-                        self.led_control(led_id, r, g, b)
-                else:
-                    i += 1
+            return self.send_command(mavutil.mavlink.MAV_CMD_USER_1, led_id, led_value[0], led_value[1], led_value[2],
+                                     description='LED id: %s RGB send complete' % led_id_print)
         else:
             if self.__logger:
                 print('wrong LED RGB values or id')
+            return _completed_future(False)
 
     def go_to_local_point(self, x=None, y=None, z=None, vx=None, vy=None, vz=None, afx=None, afy=None, afz=None,
                           yaw=None, yaw_rate=None):
         ack_timeout = 0.1
         send_time = time.time()
-        parameters = dict(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, afx=afx, afy=afy, afz=afz, force_set=0, yaw=yaw,
-                          yaw_rate=yaw_rate)  # 0-force_set
-        mask = 0b0000111111111111
-        element_mask = 0b0000000000000001
-        for n, v in parameters.items():
-            if v is not None:
-                mask = mask ^ element_mask
-            else:
-                parameters[n] = 0.0
-            element_mask = element_mask << 1
+        mask, parameters = local_point_parameters(x=x, y=y, z=z, vx=vx, vy=vy, vz=vz, afx=afx, afy=afy, afz=afz,
+                                                  yaw=yaw, yaw_rate=yaw_rate)
         if self.__logger:
             print('sending local point :', end=' ')
             first_output = True
@@ -369,9 +1060,10 @@ class Pioneer:
                     else:
                         print(', ', n, ' = ', v, sep="", end='')
             print(end='\n')
+        self.__mavlink_reader.clear('POSITION_TARGET_LOCAL_NED')  # Whatever has been received before is not an ack
         counter = 1
         while True:
-            if not self.__ack_receive_point():
+            if not self.__ack_receive_point(blocking=True, timeout=ack_timeout):
                 if (time.time() - send_time) >= ack_timeout:
                     counter += 1
                     self.__mavlink_socket.mav.set_position_target_local_ned_send(0,  # time_boot_ms
@@ -389,15 +1081,10 @@ class Pioneer:
                 break
 
     def point_reached(self, blocking=False):
-        point_reached = self.__mavlink_socket.recv_match(type='MISSION_ITEM_REACHED', blocking=blocking,
-                                                         timeout=self.__ack_timeout)
+        point_reached = self.__mavlink_reader.get('MISSION_ITEM_REACHED',
+                                                  timeout=self.__ack_timeout if blocking else 0)
         if not point_reached:
             return False
-        if point_reached.get_type() == "BAD_DATA":
-            if mavutil.all_printable(point_reached.data):
-                sys.stdout.write(point_reached.data)
-                sys.stdout.flush()
-                return False
         else:
             point_id = point_reached.seq
             if self.__prev_point_id is None:
@@ -416,49 +1103,81 @@ class Pioneer:
                 return False
 
     def get_local_position(self, blocking=False):
-        position = self.__mavlink_socket.recv_match(type='POSITION_TARGET_LOCAL_NED', blocking=blocking,
-                                                    timeout=self.__ack_timeout)
+        """
+        :param blocking: wait for a message received after the call, return the latest one received otherwise
+        """
+        if blocking:
+            position = self.__mavlink_reader.wait_latest('POSITION_TARGET_LOCAL_NED', self.__ack_timeout)
+        else:
+            position, _ = self.__mavlink_reader.latest('POSITION_TARGET_LOCAL_NED')
 
         if not position:
             return
-        if position.get_type() == "BAD_DATA":
-            if mavutil.all_printable(position.data):
-                sys.stdout.write(position.data)
-                sys.stdout.flush()
         else:
-            if self.__logger:
-                print("X: {x}, Y: {y}, Z: {z}, YAW: {yaw}".format(x=position.x, y=position.y, z=-position.z,
-                                                                  yaw=position.yaw))
             return position
 
     def get_dist_sensor_data(self, blocking=False):
-        dist_sensor_data = self.__mavlink_socket.recv_match(type='DISTANCE_SENSOR', blocking=blocking,
-                                                            timeout=self.__ack_timeout)
+        """
+        :param blocking: wait for a message received after the call, return the latest one received otherwise
+        """
+        if blocking:
+            dist_sensor_data = self.__mavlink_reader.wait_latest('DISTANCE_SENSOR', self.__ack_timeout)
+        else:
+            dist_sensor_data, _ = self.__mavlink_reader.latest('DISTANCE_SENSOR')
         if not dist_sensor_data:
             return
-        if dist_sensor_data.get_type() == "BAD_DATA":
-            if mavutil.all_printable(dist_sensor_data.data):
-                sys.stdout.write(dist_sensor_data.data)
-                sys.stdout.flush()
-                return
         else:
             curr_distance = float(dist_sensor_data.current_distance)/100  # cm to m
-            if self.__logger:
-                print("get dist sensor data: %5.2f m" % curr_distance)
             return curr_distance
 
+    def set_message_interval(self, message_type, rate):
+        """
+        Asks the vehicle to stream messages of the type at the rate, with MAV_CMD_SET_MESSAGE_INTERVAL
+        :param message_type: e.g. 'DISTANCE_SENSOR'
+        :param rate: Hz, 0 to stop streaming the messages, None for the vehicle's default rate
+        :return: concurrent.futures.Future, its result is True if the request has been accepted
+        """
+        message_id = getattr(mavutil.mavlink, 'MAVLINK_MSG_ID_' + message_type)
+        if rate is None:
+            interval = 0
+        elif rate <= 0:
+            interval = -1
+        else:
+            interval = 1e6 / rate  # us
+        return self.send_command(mavutil.mavlink.MAV_CMD_SET_MESSAGE_INTERVAL, message_id, interval)
+
+    def subscribe_telemetry(self, message_type, rate=None, callback=None):
+        """
+        The latest message of every type is kept anyway, see `get_telemetry`. This requests the rate messages of the
+        type are streamed at, and registers a callback for them
+        :param rate: Hz, see `set_message_interval`. The rate is left as it is, if None
+        :param callback: called with every message of the type, from the reader thread. Should be quick
+        :return: concurrent.futures.Future of the rate request
+        """
+        if callback is not None:
+            self.__mavlink_reader.subscribe(message_type, callback)
+        if rate is None:
+            return _completed_future(True)
+        return self.set_message_interval(message_type, rate)
+
+    def get_telemetry(self, message_type, max_age=None):
+        """
+        Never blocks nor touches the link, so it is fine to call from a control loop
+        :param max_age: seconds, an older message is treated as missing
+        :return: (latest message of the type, time.monotonic() it has been received at, rate messages of the type
+        arrive at, Hz), None if there is no message
+        """
+        message, timestamp = self.__mavlink_reader.latest(message_type)
+        if message is None or (max_age is not None and time.monotonic() - timestamp > max_age):
+            return None
+        return message, timestamp, self.__mavlink_reader.rate(message_type)
+
     def __ack_receive_point(self, blocking=False, timeout=None):
         if timeout is None:
             timeout = self.__ack_timeout
-        ack = self.__mavlink_socket.recv_match(type='POSITION_TARGET_LOCAL_NED', blocking=blocking,
-                                               timeout=timeout)
+        ack = self.__mavlink_reader.get('POSITION_TARGET_LOCAL_NED', timeout=timeout if blocking else 0)
         if not ack:
             return False
-        if ack.get_type() == "BAD_DATA":
-            if mavutil.all_printable(ack.data):
-                sys.stdout.write(ack.data)
-                sys.stdout.flush()
-            return False
         else:
             return True
 
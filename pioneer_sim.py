@@ -0,0 +1,219 @@
+"""
+A local stand-in for a Pioneer, so the client side can be run and benchmarked without a vehicle.
+
+The simulator serves the video control handshake over TCP, streams JPEG frames over UDP the way
+`pioneer_sdk.Pioneer.get_raw_video_frame` expects them, and speaks enough MAVLink for `pioneer_sdk.Pioneer.__init__`
+to complete. Point a client at it with `Pioneer(pioneer_ip='127.0.0.1')`.
+
+    python3 pioneer_sim.py --fps 30 --packet-size 1400 --loss-rate 0.01
+    python3 pioneer_sim.py --benchmark 10
+"""
+
+from pymavlink import mavutil
+import argparse
+import random
+import socket
+import threading
+import time
+import zlib
+
+
+def synthetic_frames(width=640, height=480, quality=80):
+    """
+    Generates JPEG frames of a rectangle moving over a gradient, so a tracker has something to follow
+    """
+    import numpy as np
+    import cv2
+
+    background = np.zeros((height, width, 3), dtype=np.uint8)
+    background[:, :, 0] = np.linspace(0, 255, width, dtype=np.uint8)
+    background[:, :, 1] = np.linspace(0, 255, height, dtype=np.uint8)[:, None]
+    side = min(width, height) // 8
+    i = 0
+    while True:
+        img = background.copy()
+        x = int((width - side) * (0.5 + 0.4 * np.sin(i / 50.)))
+        y = int((height - side) * (0.5 + 0.4 * np.cos(i / 70.)))
+        cv2.rectangle(img, (x, y), (x + side, y + side), (0, 0, 255), -1)
+        cv2.putText(img, str(i), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2, cv2.LINE_AA)
+        yield cv2.imencode('.jpg', img, (cv2.IMWRITE_JPEG_QUALITY, quality))[1].tobytes()
+        i += 1
+
+
+class PioneerSimulator:
+
+    def __init__(self, ip='127.0.0.1', video_control_port=8888, mavlink_port=8001, fps=30., packet_size=1400,
+                 loss_rate=0., frames=None, logger=False):
+        """
+        :param fps: video frame rate
+        :param packet_size: maximum video datagram payload size
+        :param loss_rate: probability of a video datagram being dropped
+        :param frames: iterable of JPEG frames to stream, `synthetic_frames()` if None
+        """
+        self.fps = fps
+        self.packet_size = packet_size
+        self.loss_rate = loss_rate
+        self.frames = frames if frames is not None else synthetic_frames()
+        self.logger = logger
+
+        self.__video_control_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.__video_control_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.__video_control_socket.bind((ip, video_control_port))
+        self.__video_control_socket.listen(1)
+        self.__video_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.__mavlink = mavutil.mavlink_connection('udpin:%s:%s' % (ip, mavlink_port), source_system=1,
+                                                    source_component=1)
+
+        self.__lock = threading.Lock()
+        self.__run_flag = True
+        self.__mission_seq = 0
+        self.__frame_send_time = {}  # crc32 of a frame -> time.monotonic() its first datagram has been sent at
+
+        self.rc_overrides = []  # (time.monotonic(), (channel 1, ..., channel 8))
+        self.commands = []  # (time.monotonic(), COMMAND_LONG)
+        self.n_frames_sent = 0
+        self.n_datagrams_sent = 0
+        self.n_datagrams_lost = 0
+
+        self.__threads = [threading.Thread(target=self.__video_task), threading.Thread(target=self.__mavlink_task),
+                          threading.Thread(target=self.__heartbeat_task)]
+        for thread in self.__threads:
+            thread.daemon = True
+
+    def start(self):
+        for thread in self.__threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self.__run_flag = False
+        self.__video_control_socket.close()
+
+    def frame_send_time(self, frame):
+        """
+        :return: time.monotonic() a streamed frame has been sent at, or None if it is unknown
+        """
+        with self.__lock:
+            return self.__frame_send_time.get(zlib.crc32(frame))
+
+    def __video_task(self):
+        try:
+            connection, address = self.__video_control_socket.accept()
+        except OSError:
+            return
+        if self.logger:
+            print('video client connected: %s:%d' % address)
+
+        period = 1. / self.fps
+        deadline = time.monotonic()
+        for frame in self.frames:
+            if not self.__run_flag:
+                break
+            deadline += period
+            send_time = time.monotonic()
+            with self.__lock:
+                self.__frame_send_time[zlib.crc32(frame)] = send_time
+                if len(self.__frame_send_time) > 1024:
+                    self.__frame_send_time.pop(next(iter(self.__frame_send_time)))
+            for offset in range(0, len(frame), self.packet_size):
+                if random.random() < self.loss_rate:
+                    self.n_datagrams_lost += 1
+                    continue
+                try:
+                    self.__video_socket.sendto(frame[offset:offset + self.packet_size], address)
+                except OSError:
+                    return
+                self.n_datagrams_sent += 1
+            self.n_frames_sent += 1
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+        connection.close()
+
+    def __heartbeat_task(self):
+        while self.__run_flag:
+            self.__mavlink.mav.heartbeat_send(mavutil.mavlink.MAV_TYPE_QUADROTOR,
+                                              mavutil.mavlink.MAV_AUTOPILOT_GENERIC, 0, 0,
+                                              mavutil.mavlink.MAV_STATE_STANDBY)
+            # The latest reached point is repeated, as a client may have consumed the message while waiting for a
+            # different one
+            self.__mavlink.mav.mission_item_reached_send(self.__mission_seq)
+            time.sleep(.2)
+
+    def __mavlink_task(self):
+        while self.__run_flag:
+            message = self.__mavlink.recv_match(blocking=True, timeout=.1)
+            if message is None:
+                continue
+            message_type = message.get_type()
+            if message_type == 'COMMAND_LONG':
+                self.commands.append((time.monotonic(), message))
+                self.__mavlink.mav.command_ack_send(message.command, mavutil.mavlink.MAV_RESULT_ACCEPTED)
+            elif message_type == 'RC_CHANNELS_OVERRIDE':
+                self.rc_overrides.append((time.monotonic(), tuple(getattr(message, 'chan%d_raw' % i)
+                                                                  for i in range(1, 9))))
+            elif message_type == 'SET_POSITION_TARGET_LOCAL_NED':
+                self.__mavlink.mav.position_target_local_ned_send(0, message.coordinate_frame, message.type_mask,
+                                                                  message.x, message.y, message.z, message.vx,
+                                                                  message.vy, message.vz, message.afx, message.afy,
+                                                                  message.afz, message.yaw, message.yaw_rate)
+                self.__mission_seq += 1  # The point is reached right away
+                self.__mavlink.mav.mission_item_reached_send(self.__mission_seq)
+
+
+def benchmark(simulator, duration):
+    import pioneer_sdk
+
+    time_start = time.monotonic()
+    pioneer = pioneer_sdk.Pioneer(pioneer_ip='127.0.0.1', logger=False)
+    time_connected = time.monotonic()
+
+    latencies = []
+    n_frames = 0
+    n_bytes = 0
+    while time.monotonic() - time_connected < duration:
+        frame = pioneer.get_video_frame()
+        if frame is None:
+            continue
+        n_frames += 1
+        n_bytes += frame.size
+        send_time = simulator.frame_send_time(frame.data)
+        if send_time is not None:
+            latencies.append(frame.timestamp - send_time)
+        pioneer.rc_channels(0, 0, 0, 0, 2)
+    elapsed = time.monotonic() - time_connected
+
+    latencies.sort()
+    print('connection time: %.3f s' % (time_connected - time_start))
+    print('frames: %d (%.1f fps), %.2f MB/s' % (n_frames, n_frames / elapsed, n_bytes / elapsed / 1e6))
+    if latencies:  # Frames damaged by a lost datagram can not be matched
+        print('latency, ms: p50 %.3f, p95 %.3f, max %.3f' % (latencies[len(latencies) // 2] * 1e3,
+                                                             latencies[int(len(latencies) * .95)] * 1e3,
+                                                             latencies[-1] * 1e3))
+    print('datagrams sent / lost: %d / %d' % (simulator.n_datagrams_sent, simulator.n_datagrams_lost))
+    print('receive statistics: %s' % pioneer.get_video_statistics())
+    print('RC overrides captured: %d' % len(simulator.rc_overrides))
+
+
+def getarparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ip', type=str, default='127.0.0.1')
+    parser.add_argument('--fps', type=float, default=30.)
+    parser.add_argument('--packet-size', type=int, default=1400, help='maximum video datagram size')
+    parser.add_argument('--loss-rate', type=float, default=0., help='probability of a video datagram being dropped')
+    parser.add_argument('--benchmark', type=float, default=None, metavar='SECONDS',
+                        help='connect a client to the simulator and report throughput and latency')
+    return parser
+
+
+if __name__ == '__main__':
+    opts = getarparser().parse_args()
+    simulator = PioneerSimulator(opts.ip, fps=opts.fps, packet_size=opts.packet_size, loss_rate=opts.loss_rate,
+                                 logger=opts.benchmark is None).start()
+    if opts.benchmark is not None:
+        benchmark(simulator, opts.benchmark)
+    else:
+        while True:
+            time.sleep(1)
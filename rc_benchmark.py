@@ -0,0 +1,64 @@
+"""
+Micro-benchmark of sending RC_CHANNELS_OVERRIDE through pymavlink's generic encoder versus
+`pioneer_sdk.RcChannelsOverrideSender`. The messages are sent to a local UDP socket, no vehicle is needed.
+
+    python3 rc_benchmark.py --n 100000
+"""
+
+from pymavlink import mavutil
+from pioneer_sdk import RcChannelsOverrideSender, rc_channels_values
+import argparse
+import socket
+import time
+
+
+def _run(send, n, n_values):
+    values = [rc_channels_values(i / n_values * 2 - 1, 0, 0, 0, 2) for i in range(n_values)]
+    time_start = time.perf_counter()
+    for i in range(n):
+        send(values[i % n_values])
+    return (time.perf_counter() - time_start) / n
+
+
+def benchmark(n, n_values):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sink.setblocking(False)
+    connection = mavutil.mavlink_connection('udpout:127.0.0.1:%d' % sink.getsockname()[1])
+    sender = RcChannelsOverrideSender(connection)
+
+    def send_generic(values):
+        connection.mav.rc_channels_override_send(1, 1, *values)
+
+    def send_fast(values):
+        sender.send(1, 1, values)
+
+    def drain():
+        try:
+            while True:
+                sink.recv(64)
+        except BlockingIOError:
+            pass
+
+    results = []
+    for name, send in (('generic', send_generic), ('fast path', send_fast)):
+        duration = 0.
+        for offset in range(0, n, 1000):  # The sink is drained on the way, so the socket buffer never fills up
+            duration += _run(send, min(1000, n - offset), n_values) * min(1000, n - offset)
+            drain()
+        results.append(duration / n)
+        print('%-10s %.2f us per message' % (name, duration / n * 1e6))
+    print('speedup: %.1fx' % (results[0] / results[1]))
+
+
+def getarparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--n', type=int, default=100000, help='number of messages per path')
+    parser.add_argument('--n-values', type=int, default=1,
+                        help='number of distinct channel values cycled through, 1 is a stream of keepalives')
+    return parser
+
+
+if __name__ == '__main__':
+    opts = getarparser().parse_args()
+    benchmark(opts.n, opts.n_values)
@@ -0,0 +1,105 @@
+"""
+Startup time of the control stack. Every measurement is taken in a fresh interpreter:
+
+- import time of each of the modules entry points are made of;
+- time from launch to the modules being imported, to the connection being up, and to the first RC packet reaching
+  the vehicle, measured against `pioneer_sim`, the way `manual` and `ui_control` start up.
+
+    python3 startup_benchmark.py
+    python3 startup_benchmark.py --modules pioneer_sdk controller --n 5
+"""
+
+from pioneer_sim import PioneerSimulator
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+
+
+MODULES = ['pioneer_sdk', 'controller', 'camera', 'tracker_propagation', 'ui_control', 'manual']
+
+_IMPORT_SCRIPT = """
+import time
+time_start = time.perf_counter()
+import {module}
+print(time.perf_counter() - time_start)
+"""
+
+_CONNECT_SCRIPT = """
+import sys
+import threading
+import time
+time_launch = float(sys.argv[1])
+import controller
+time_imported = time.monotonic()
+pioneer = controller.RcWrapper(pioneer_ip='127.0.0.1', pioneer_video_control_port=int(sys.argv[2]),
+                               pioneer_mavlink_port=int(sys.argv[3]), logger=False)
+time_connected = time.monotonic()
+threading.Thread(target=pioneer.push_rc_task, daemon=True).start()
+print(time_imported - time_launch, time_connected - time_launch, flush=True)
+time.sleep(2)
+"""
+
+
+def _run(script, *args):
+    result = subprocess.run([sys.executable, '-c', script] + [str(arg) for arg in args], capture_output=True,
+                            text=True, timeout=30)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+    return [float(value) for value in result.stdout.split()]
+
+
+def benchmark_imports(modules, n):
+    for module in modules:
+        try:
+            durations = [_run(_IMPORT_SCRIPT.format(module=module))[0] for _ in range(n)]
+        except (RuntimeError, subprocess.TimeoutExpired) as exc:
+            print('import %-20s failed: %s' % (module, exc))
+            continue
+        print('import %-20s %7.1f ms' % (module, statistics.median(durations) * 1e3))
+
+
+def benchmark_connection(n, port):
+    """
+    Every run gets a simulator of its own, as a simulator serves a single video client
+    """
+    results = []
+    for i in range(n):
+        video_control_port, mavlink_port = port + 2 * i, port + 2 * i + 1
+        simulator = PioneerSimulator(video_control_port=video_control_port, mavlink_port=mavlink_port,
+                                     frames=iter(())).start()
+        time_launch = time.monotonic()
+        process = subprocess.Popen([sys.executable, '-c', _CONNECT_SCRIPT, str(time_launch), str(video_control_port),
+                                    str(mavlink_port)], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        while not simulator.rc_overrides and process.poll() is None and time.monotonic() - time_launch < 30:
+            time.sleep(.001)
+        if not simulator.rc_overrides:
+            process.kill()
+            print('connection failed: %s' % process.communicate()[1].strip())
+            simulator.stop()
+            return
+        time_rc = simulator.rc_overrides[0][0] - time_launch
+        time_imported, time_connected = (float(value) for value in process.stdout.readline().split())
+        process.wait()
+        simulator.stop()
+        results.append((time_imported, time_connected, time_rc))
+
+    for name, values in zip(('imported', 'connected', 'first RC packet'), zip(*results)):
+        print('launch to %-16s %7.1f ms' % (name, statistics.median(values) * 1e3))
+
+
+def getarparser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--modules', type=str, nargs='+', default=MODULES)
+    parser.add_argument('--n', type=int, default=3, help='number of runs, medians are reported')
+    parser.add_argument('--port', type=int, default=18800, help='first port of the simulators')
+    parser.add_argument('--no-connection', action='store_true', help='only measure import times')
+    return parser
+
+
+if __name__ == '__main__':
+    opts = getarparser().parse_args()
+    benchmark_imports(opts.modules, opts.n)
+    if not opts.no_connection:
+        benchmark_connection(opts.n, opts.port)
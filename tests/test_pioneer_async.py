@@ -0,0 +1,24 @@
+from pymavlink import mavutil
+from pioneer_async import AsyncPioneer
+
+
+class _NullWriter:
+
+    def write(self, buf):
+        pass
+
+
+def test_corrupt_datagram_is_skipped():
+    mav = mavutil.mavlink.MAVLink(_NullWriter(), srcSystem=1, srcComponent=1)
+    heartbeat = mav.heartbeat_encode(mavutil.mavlink.MAV_TYPE_QUADROTOR, 0, 0, 0, 0).pack(mav)
+    ack = mav.command_ack_encode(mavutil.mavlink.MAV_CMD_NAV_TAKEOFF, 0).pack(mav)
+    corrupt = bytearray(heartbeat)
+    corrupt[-1] ^= 0xff  # Bad CRC
+
+    pioneer = AsyncPioneer(logger=False)
+    pioneer._on_mavlink_datagram(bytes(corrupt))
+    pioneer._on_mavlink_datagram(ack)
+
+    assert pioneer.n_mavlink_bad_data == 1
+    assert 'HEARTBEAT' not in pioneer.messages
+    assert pioneer.messages['COMMAND_ACK'].command == mavutil.mavlink.MAV_CMD_NAV_TAKEOFF
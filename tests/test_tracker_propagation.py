@@ -0,0 +1,38 @@
+import types
+import numpy as np
+import pytest
+from tracker_propagation import TrackerPropagation, MultiTrackerPropagation, FRAME_INTERVAL
+
+
+OPTS = types.SimpleNamespace(tracker_name='kcf', min_hits=2, max_age=300)
+RECT = (50, 50, 40, 40)
+
+
+def _frame():
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    x, y, w, h = RECT
+    frame[y:y + h, x:x + w] = 255
+    return frame
+
+
+@pytest.mark.parametrize('create', [
+    lambda frame: TrackerPropagation(frame, np.array(RECT), OPTS, propogate=False, timestamp=0.),
+    lambda frame: MultiTrackerPropagation(frame, [RECT], OPTS, propogate=False, timestamp=0.),
+])
+def test_gap_longer_than_max_dt(create):
+    frame = _frame()
+    tracker = create(frame)
+    try:
+        gap = 4 * tracker.kf.MAX_DT * FRAME_INTERVAL
+        tracker.track(frame, FRAME_INTERVAL)
+        tracker.track(frame, FRAME_INTERVAL + gap)
+        assert tracker.state_time == FRAME_INTERVAL + gap
+
+        # The next frame is predicted over the frame interval, not over what is left of the gap
+        covariance = np.array(tracker.covariance)
+        tracker.track(frame, 2 * FRAME_INTERVAL + gap)
+        assert tracker.state_time == pytest.approx(2 * FRAME_INTERVAL + gap)
+        assert np.all(np.diagonal(tracker.covariance, axis1=-2, axis2=-1) <
+                      2 * np.diagonal(covariance, axis1=-2, axis2=-1))
+    finally:
+        tracker.stop()
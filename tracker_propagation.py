@@ -1,10 +1,12 @@
+from multiprocessing import shared_memory
+import collections
 import cv2
+import multiprocessing
+import threading
 import time
 import numpy as np
-from kalman_filter import  KalmanFilter, chi2inv95
+from kalman_filter import KalmanFilter, KalmanFilterInPlace, chi2inv95
 
-from queue import Queue
-from PyQt5.QtCore import pyqtSignal, pyqtSlot, Qt, QThread, QObject
 
 class TRACKER_STATES(object):
     STATE_TENTATIVE = 1
@@ -17,57 +19,275 @@ TRACKERS = {
     'mil':        cv2.TrackerMIL_create,
 }
 
+# Nominal frame interval, s. Time unit of the Kalman filters: the time between frames is given to them in it, and
+# their motion uncertainty is tuned for a step of it
+FRAME_INTERVAL = 1. / 30
 
-class Tracker(QThread):
 
-    frame_processed = pyqtSignal(np.ndarray)
+class Tracker(threading.Thread):
+    """
+    Runs an OpenCV tracker in a thread of its own. Only the newest submitted frame waits to be processed, a frame
+    submitted while another one is waiting replaces it. The outcome of the last processed frame is kept in `result`,
+    a (frame sequence number, bbox or None) tuple which is replaced as a whole, so it is read without locking.
+    """
 
-    def __init__(self, tracker_name, frame, rect, frame_queue):
+    def __init__(self, tracker_name, frame, rect):
 
         super().__init__()
+        self.daemon = True
 
+        self.tracker_name = tracker_name
         self.tracker = TRACKERS[tracker_name]()
         self.tracker.init(frame, rect)
-        self.frame_queue = frame_queue
+        self.result = (0, None)
+        self._frame = None  # (sequence number, frame, rect or None) waiting to be processed
+        self._condition = threading.Condition()
         self._run_flag = True
 
+    def submit(self, frame, seq, rect=None, copy=True):
+        """
+        :param frame: gets copied, so the caller may draw on it afterwards
+        :param seq: frame sequence number, increasing
+        :param rect: if given, the tracker is initialized anew with the frame and the rect instead of being updated,
+        its result for the frame is None. A frame waiting to initialize the tracker is not replaced by one which is not
+        :param copy: False if the frame is a copy nobody modifies, e.g. one shared by several trackers
+        """
+        if copy:
+            frame = np.copy(frame)
+        with self._condition:
+            if rect is None and self._frame is not None and self._frame[2] is not None:
+                return
+            self._frame = (seq, frame, rect)
+            self._condition.notify_all()
+
+    def wait_result(self, seq, timeout=None):
+        """
+        Waits for a frame with a sequence number `seq` or greater to be processed
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self.result[0] >= seq or not self._run_flag, timeout)
+
     def run(self):
 
-        while self._run_flag:
-            print('getting frame')
-            frame = self.frame_queue.get()
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._frame is not None or not self._run_flag)
+                if not self._run_flag:
+                    break
+                seq, frame, rect = self._frame
+                self._frame = None
+
+            if rect is not None:
+                self.tracker = TRACKERS[self.tracker_name]()
+                self.tracker.init(frame, rect)
+                success, bbox = False, None
+            else:
+                success, bbox = self.tracker.update(frame)
+
+            with self._condition:
+                self.result = (seq, np.array(bbox) if success else None)
+                self._condition.notify_all()
 
-            if frame is None:
-                print('break')
+    def stop(self):
+        with self._condition:
+            self._run_flag = False
+            self._condition.notify_all()
+
+
+def _tracker_process(shm_name, n_slots, shape, dtype, tracker_name, rect, frame_size, connection):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray((n_slots,) + shape, dtype=dtype, buffer=shm.buf)
+    try:
+        tracker = TRACKERS[tracker_name]()
+        height, width = frame_size
+        tracker.init(slots[0][:height, :width], rect)
+        connection.send((0, None))  # Slot 0 may be reused
+        while True:
+            try:
+                task = connection.recv()
+            except EOFError:
                 break
-
-
-            success, bbox = self.tracker.update(frame)
-            if success:
-                x, y, w, h = bbox
-                self.frame_processed.emit(np.array([x,y,w,h]))
-            print('task finished')
-            #time.sleep(.2)
-            self.frame_queue.task_done()
-
+            if task is None:
+                break
+            slot, seq, height, width, rect = task
+            if rect is not None:
+                tracker = TRACKERS[tracker_name]()
+                tracker.init(slots[slot][:height, :width], rect)
+                connection.send((seq, None))
+                continue
+            success, bbox = tracker.update(slots[slot][:height, :width])
+            connection.send((seq, tuple(bbox) if success else None))
+    finally:
+        del slots
+        shm.close()
+
+
+class ProcessTracker:
+    """
+    Same as `Tracker`, but the OpenCV tracker runs in a child process, so its `update` does not hold this process'
+    GIL. Frames are handed over through a ring of shared memory slots sized from the first frame, the child reads the
+    slot it is told to over a pipe and sends the bbox back. One frame is processed at a time, and only the newest
+    submitted frame waits for it.
+    """
+
+    CHILD_CHECK_PERIOD = .5  # Seconds between checks that the child process is alive while waiting for a result
+
+    def __init__(self, tracker_name, frame, rect, n_slots=3, shape=None):
+        """
+        :param frame: first frame, the following ones must be of its type and may not be larger than it
+        :param n_slots: number of shared memory frame slots, at least 2: one being processed, one waiting
+        :param shape: shape the slots are sized for, if frames may be larger than the first one
+        """
+        self.shape = tuple(shape) if shape is not None else frame.shape
+        self.dtype = frame.dtype
+        self.result = (0, None)
+        self._run_flag = True
+        self._condition = threading.Condition()
+
+        self.__shm = shared_memory.SharedMemory(create=True, size=n_slots * int(np.prod(self.shape)) *
+                                                self.dtype.itemsize)
+        self.__slots = np.ndarray((n_slots,) + self.shape, dtype=self.dtype, buffer=self.__shm.buf)
+        self.__slots[0][:frame.shape[0], :frame.shape[1]] = frame
+        self.__in_flight = 0  # Slot the child is processing, the first frame is being used for initialization
+        self.__waiting = None  # (slot, sequence number, height, width, rect) of the frame waiting to be processed
+        self.__next_slot = 1
+
+        self.__connection, self.__child_connection = multiprocessing.Pipe()
+        self.__process = multiprocessing.Process(target=_tracker_process,
+                                                 args=(self.__shm.name, n_slots, self.shape, self.dtype, tracker_name,
+                                                       tuple(int(v) for v in rect), frame.shape[:2],
+                                                       self.__child_connection),
+                                                 daemon=True)
+        self.__receiver = threading.Thread(target=self.__receive_task)
+        self.__receiver.daemon = True
+
+    def start(self):
+        self.__process.start()
+        self.__child_connection.close()  # So the pipe reports EOF once the child is gone
+        self.__receiver.start()
+
+    def __free_slot(self):
+        while self.__next_slot == self.__in_flight:
+            self.__next_slot = (self.__next_slot + 1) % len(self.__slots)
+        slot = self.__next_slot
+        self.__next_slot = (self.__next_slot + 1) % len(self.__slots)
+        return slot
+
+    def submit(self, frame, seq, rect=None, copy=True):
+        """
+        :param frame: gets copied to shared memory, so the caller may draw on it afterwards
+        :param seq: frame sequence number, increasing
+        :param rect: if given, the tracker is initialized anew, see `Tracker.submit`
+        :param copy: unused, the frame is always copied to shared memory
+        """
+        height, width = frame.shape[:2]
+        if (frame.shape[2:] != self.shape[2:] or height > self.shape[0] or width > self.shape[1] or
+                frame.dtype != self.dtype):
+            raise ValueError('frame is larger than the slots, or of a different type')
+        with self._condition:
+            if not self._run_flag:
+                return
+            if rect is None and self.__waiting is not None and self.__waiting[4] is not None:
+                return
+            if rect is not None:
+                rect = tuple(int(v) for v in rect)
+            slot = self.__waiting[0] if self.__waiting is not None else self.__free_slot()
+            self.__slots[slot][:height, :width] = frame
+            if self.__in_flight is None:
+                try:
+                    self.__connection.send((slot, seq, height, width, rect))
+                except (BrokenPipeError, EOFError):  # The child has died, `wait_result` tells so
+                    return
+                self.__in_flight = slot
+            else:
+                self.__waiting = (slot, seq, height, width, rect)
+
+    def wait_result(self, seq, timeout=None):
+        """
+        Waits for a frame with a sequence number `seq` or greater to be processed
+        :return: False on timeout, or if the child process is gone and the result will never come
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self._condition:
+            while self.result[0] < seq:
+                if not self._run_flag or not self.__process.is_alive():
+                    return False
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(min(remaining, self.CHILD_CHECK_PERIOD) if remaining is not None
+                                     else self.CHILD_CHECK_PERIOD)
+            return True
+
+    def __receive_task(self):
+        while True:
+            try:
+                seq, bbox = self.__connection.recv()
+            except (EOFError, OSError):
+                with self._condition:  # The child is gone, so are the results being waited for
+                    self._condition.notify_all()
+                break
+            with self._condition:
+                if seq > 0:
+                    self.result = (seq, np.array(bbox) if bbox is not None else None)
+                self.__in_flight = None
+                if self.__waiting is not None and self._run_flag:
+                    self.__in_flight = self.__waiting[0]
+                    try:
+                        self.__connection.send(self.__waiting)
+                    except (BrokenPipeError, EOFError):  # The child has died, the next receive tells so
+                        pass
+                    self.__waiting = None
+                self._condition.notify_all()
 
     def stop(self):
-        self._run_flag = False
-        self.stop()
-
-
-
-class TrackerPropagation(QObject):
-
-    def __init__(self, frame, rect, opts, propogate=True):
-
-        super().__init__()
-
-        self.frame_queue = Queue(1)
-        self.kf = KalmanFilter()
-        self.threshold = chi2inv95[4]
+        with self._condition:
+            if not self._run_flag:
+                return
+            self._run_flag = False
+            self._condition.notify_all()
+            try:
+                self.__connection.send(None)
+            except (BrokenPipeError, EOFError):  # The child has died already
+                pass
+        self.__process.join()
+        self.__receiver.join()
+        self.__connection.close()
+        del self.__slots
+        self.__shm.close()
+        self.__shm.unlink()
+
+
+class TrackerPropagation:
+    """
+    Propagates the bbox with a Kalman filter on every frame, and corrects it with the bboxes of the tracker thread as
+    they come. The tracker's results are applied by `track`, in the caller's thread, in the order of the frames.
+    """
+
+    SEARCH_WINDOW_SCALE = 2.5  # Search window size relative to the bbox, covers the search area of the trackers
+    SEARCH_WINDOW_SIGMAS = 3.  # Search window extension, in standard deviations of the predicted position
+    SEARCH_WINDOW_STEP = 16  # Window sizes are multiples of it
+    SEARCH_WINDOW_RESIZE_RATIO = 1.25  # The window is resized once the size it should be of differs by this ratio
+    PYRAMID_MAX_LEVEL = 4  # Frames are downscaled by at most 2 ** PYRAMID_MAX_LEVEL
+    PYRAMID_HYSTERESIS = 2.  # A finer level is switched to once the bbox is this much within the budget there
+
+    def __init__(self, frame, rect, opts, propogate=True, process=False, search_window=False, pyramid_budget=None,
+                 timestamp=None):
+        """
+        :param propogate: if False, `track` waits for the tracker to process the frame
+        :param process: run the OpenCV tracker in a child process, see `ProcessTracker`
+        :param search_window: hand the tracker a view of a window around the predicted bbox instead of the whole
+        frame, see `_search_window`. The window follows the prediction, so the tracker sees the target's motion
+        relative to it
+        :param pyramid_budget: bbox area, in pixels, the tracker is to work with. Frames are handed to the tracker
+        downscaled to the pyramid level the predicted bbox fits the budget at, see `_pyramid_level`. The tracker is
+        initialized anew with the predicted bbox when the level changes. None to track at full resolution
+        :param timestamp: time.monotonic() the frame has been received at, now if None
+        """
         self.rect = self._to_xyah(rect)
-        self.mean, self.covariance = self.kf.initiate(self.rect)
+        self.kf = KalmanFilterInPlace(self.rect, time_unit=FRAME_INTERVAL)
+        self.threshold = chi2inv95[4]
+        self.mean, self.covariance = self.kf.mean, self.kf.covariance  # Updated in place by the filter
 
         self.hits = 1
         self.age = 1
@@ -75,25 +295,85 @@ class TrackerPropagation(QObject):
         self.state = TRACKER_STATES.STATE_TENTATIVE
         self.propogate = propogate
 
-        self.tracker = Tracker(opts.tracker_name.lower(), frame, rect, self.frame_queue)
-        self.tracker.frame_processed.connect(self.tracker_update)
+        self.search_window = search_window
+        self.pyramid_budget = pyramid_budget
+        self.frame_shape = frame.shape
+        # (frame sequence number, (x, y) of the window handed to the tracker, its scale)
+        self.offsets = collections.deque()
+        self.window_size = None  # Width, height of the search window
+        self.level = 0  # Pyramid level the tracker works at
+        if pyramid_budget:
+            self.level = self._pyramid_level(self.mean)
+        frame, (x, y), scale = self._tracker_input(frame, self.mean, self.covariance)
+        rect = tuple(int(round(v)) for v in (np.asarray(rect) - (x, y, 0, 0)) / scale)
+
+        if process:
+            self.tracker = ProcessTracker(opts.tracker_name.lower(), frame, rect, shape=self.frame_shape)
+        else:
+            self.tracker = Tracker(opts.tracker_name.lower(), frame, rect)
         self.tracker.start()
+        self.seq = 0  # Sequence number of the last frame submitted to the tracker
+        self.seq_result = 0  # Sequence number of the frame the last applied tracker result is for
 
         self._n_init = opts.min_hits
         self._max_age = opts.max_age
-        self._run_flag = True
-
 
-    def track(self, frame):
-        if not self.frame_queue.full():
-            self.frame_queue.put(np.copy(frame))
+        self.timestamp = None  # Receive time of the last tracked frame
+        self.dt = None  # Time between the last two tracked frames
+        self.latency = None  # Time from receiving the last tracked frame to its bbox being ready
+        self.state_time = time.monotonic() if timestamp is None else timestamp  # Time of the filter state
+
+
+    def track(self, frame, timestamp=None):
+        """
+        :param timestamp: time.monotonic() the frame has been received at, now if None
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.dt = timestamp - self.timestamp if self.timestamp is not None else None
+        self.timestamp = timestamp
+
+        gap = timestamp - self.state_time
+        dt = self.kf.elapsed(gap)
+        self._predict(dt)
+        # A prediction is capped at MAX_DT. Past a longer gap the state is taken to be the frame's, rather than lag
+        # behind and catch up over the following frames
+        self.state_time = timestamp if gap >= self.kf.MAX_DT * FRAME_INTERVAL else self.state_time + dt
+
+        self.seq += 1
+        if self.search_window or self.pyramid_budget:
+            level = self._pyramid_level(self.mean) if self.pyramid_budget else 0
+            rect = None
+            if level != self.level:
+                self.level = level
+                rect = self._to_tlwh()
+            frame, (x, y), scale = self._tracker_input(frame, self.mean, self.covariance)
+            if rect is not None:
+                rect = tuple(int(round(v)) for v in (rect - (x, y, 0, 0)) / scale)
+            self.offsets.append((self.seq, (x, y), scale))
+            self.tracker.submit(frame, self.seq, rect)
+        else:
+            self.tracker.submit(frame, self.seq)
 
         if not self.propogate:
-            self.frame_queue.join()
+            self.tracker.wait_result(self.seq)
 
-        self._predict()
+        self._apply_tracker_result()
+        self._mark_missed()
+        self.latency = time.monotonic() - timestamp
         return self._to_tlwh(), self.state
 
+    def predict_at(self, t):
+        """
+        Extrapolates the bbox to a time, the filter is left as is. `track` predicts the state to the time the frame
+        has been received at before correcting it, so the bbox it returns is for `state_time`, which is that time
+        up to the filter's `DT_QUANTUM`
+        :param t: time.monotonic()
+        :return: tlwh bbox predicted for `t`, the one of the state if `t` is before `state_time`
+        """
+        mean, _ = self.kf.predict(self.mean, self.covariance, t - self.state_time)
+        return self._to_tlwh(mean)
+
 
     def stop(self):
         self.tracker.stop()
@@ -107,24 +387,90 @@ class TrackerPropagation(QObject):
     def is_deleted(self):
         return self.state == TRACKER_STATES.STATE_DELETED
 
-    @pyqtSlot(dict)
+    def _apply_tracker_result(self):
+        seq, bbox = self.tracker.result
+        if seq <= self.seq_result:
+            return
+        self.seq_result = seq
+        if self.search_window or self.pyramid_budget:
+            while self.offsets and self.offsets[0][0] < seq:  # Frames the tracker has skipped
+                self.offsets.popleft()
+            if not self.offsets or self.offsets[0][0] != seq:
+                return
+            _, (x, y), scale = self.offsets.popleft()
+            if bbox is not None:
+                bbox = bbox * scale + (x, y, 0, 0)
+        if bbox is not None:
+            self.tracker_update(bbox)
+
+    def _tracker_input(self, frame, mean, covariance):
+        """
+        :return: the frame, or its search window, downscaled to the pyramid level; the (x, y) of the window in the
+        frame; and the scale to multiply the tracker's bboxes by
+        """
+        x, y = 0, 0
+        if self.search_window:
+            x, y, x2, y2 = self._search_window(mean, covariance)
+            frame = frame[y:y2, x:x2]
+        if self.level:
+            frame = cv2.resize(frame, (frame.shape[1] >> self.level, frame.shape[0] >> self.level),
+                               interpolation=cv2.INTER_AREA)
+        return frame, (x, y), 2 ** self.level
+
+    def _pyramid_level(self, mean):
+        """
+        :return: the finest level the bbox of the state fits `pyramid_budget` at. A finer level than the current one is
+        only returned once the bbox fits the budget there `PYRAMID_HYSTERESIS` times over, so the tracker is not
+        initialized anew over and over when the bbox is about the budget in size
+        """
+        area = mean[2] * mean[3] ** 2
+        level = 0
+        while level < self.PYRAMID_MAX_LEVEL and area / 4 ** level > self.pyramid_budget:
+            level += 1
+        while level < self.level and area / 4 ** level * self.PYRAMID_HYSTERESIS > self.pyramid_budget:
+            level += 1
+        return level
+
+    def _search_window(self, mean, covariance):
+        """
+        :return: x1, y1, x2, y2 of the window centered at the bbox of the state, shifted to stay within the frame.
+        The window is `SEARCH_WINDOW_SCALE` times the size of the bbox, extended by `SEARCH_WINDOW_SIGMAS` standard
+        deviations of the position. Its size only changes once it is off by `SEARCH_WINDOW_RESIZE_RATIO`, since
+        trackers lose accuracy when the image they are given changes size from frame to frame
+        """
+        x, y, a, h = mean[:4]
+        std_x, std_y = np.sqrt(covariance[0, 0]), np.sqrt(covariance[1, 1])
+        width = a * h * self.SEARCH_WINDOW_SCALE + 2 * self.SEARCH_WINDOW_SIGMAS * std_x
+        height = h * self.SEARCH_WINDOW_SCALE + 2 * self.SEARCH_WINDOW_SIGMAS * std_y
+        frame_height, frame_width = self.frame_shape[:2]
+
+        ratio = self.SEARCH_WINDOW_RESIZE_RATIO
+        if self.window_size is None or not (1 / ratio < width / self.window_size[0] < ratio and
+                                            1 / ratio < height / self.window_size[1] < ratio):
+            step = self.SEARCH_WINDOW_STEP
+            self.window_size = (min(int(np.ceil(width / step)) * step, frame_width),
+                                min(int(np.ceil(height / step)) * step, frame_height))
+        width, height = self.window_size
+
+        x1 = int(np.clip(x - width / 2, 0, frame_width - width))
+        y1 = int(np.clip(y - height / 2, 0, frame_height - height))
+        return x1, y1, x1 + width, y1 + height
+
     def tracker_update(self, bbox):
-        if self.kf.gating_distance(self.mean, self.covariance, self._to_xyah(bbox)) < self.threshold:
+        if self.kf.gating_distance_state(self._to_xyah(bbox)) < self.threshold:
             self._update(bbox)
 
     def _increment_age(self):
         self.age += 1
         self.time_since_update += 1
-        self._mark_missed()
 
-    def _predict(self):
-        self.mean, self.covariance = self.kf.predict(self.mean, self.covariance)
+    def _predict(self, dt):
+        self.kf.predict_state(dt)
         self._increment_age()
 
 
     def _update(self, rect):
-        self.mean, self.covariance = self.kf.update(
-            self.mean, self.covariance, self._to_xyah(rect))
+        self.kf.update_state(self._to_xyah(rect))
         self.hits += 1
         self.time_since_update = 0
         if self.state == TRACKER_STATES.STATE_TENTATIVE and self.hits >= self._n_init:
@@ -142,8 +488,181 @@ class TrackerPropagation(QObject):
         rect[2] /= rect[3]
         return rect
 
-    def _to_tlwh(self):
-        rect = self.mean[:4].copy()
+    def _to_tlwh(self, mean=None):
+        rect = (self.mean if mean is None else mean)[:4].copy()
         rect[2] *= rect[3]
         rect[:2] -= rect[2:] / 2
-        return rect
\ No newline at end of file
+        return rect
+
+
+class MultiTrackerPropagation:
+    """
+    Follows several targets at once, e.g. decoys along with the real one, so the target can be switched to another
+    without selecting it anew. Every target has an OpenCV tracker of its own, like `TrackerPropagation` has, while
+    their Kalman filter states are stacked into (N, 8) means and (N, 8, 8) covariances, so predicting, gating and
+    updating is done for all the targets at once. The trackers work with whole frames at full resolution.
+    """
+
+    def __init__(self, frame, rects, opts, propogate=True, process=False, timestamp=None):
+        """
+        :param rects: bboxes of the targets, tlwh
+        :param propogate: if False, `track` waits for every tracker to process the frame
+        :param process: run the OpenCV trackers in child processes, see `ProcessTracker`
+        :param timestamp: time.monotonic() the frame has been received at, now if None
+        """
+        self.kf = KalmanFilter(time_unit=FRAME_INTERVAL)
+        self.threshold = chi2inv95[4]
+        self.propogate = propogate
+        self.process = process
+        self.tracker_name = opts.tracker_name.lower()
+        self._n_init = opts.min_hits
+        self._max_age = opts.max_age
+
+        self.mean = np.empty((0, 8))
+        self.covariance = np.empty((0, 8, 8))
+        self.hits = np.empty(0, dtype=int)
+        self.age = np.empty(0, dtype=int)
+        self.time_since_update = np.empty(0, dtype=int)
+        self.state = np.empty(0, dtype=int)
+        self.seq_result = np.empty(0, dtype=int)  # Per target, see `TrackerPropagation.seq_result`
+        self.trackers = []
+        self.seq = 0
+
+        self.timestamp = None
+        self.dt = None
+        self.latency = None
+        self.state_time = time.monotonic() if timestamp is None else timestamp
+
+        for rect in rects:
+            self.add(frame, rect)
+
+    def __len__(self):
+        return len(self.trackers)
+
+    def add(self, frame, rect):
+        """
+        Starts following one more target
+        :return: index of the target
+        """
+        mean, covariance = self.kf.initiate(self._to_xyah(np.asarray(rect, dtype=np.float64)))
+        rect = tuple(int(round(v)) for v in rect)
+        if self.process:
+            tracker = ProcessTracker(self.tracker_name, frame, rect)
+        else:
+            tracker = Tracker(self.tracker_name, frame, rect)
+        tracker.start()
+
+        self.trackers.append(tracker)
+        self.mean = np.concatenate((self.mean, mean[None]))
+        self.covariance = np.concatenate((self.covariance, covariance[None]))
+        self.hits = np.append(self.hits, 1)
+        self.age = np.append(self.age, 1)
+        self.time_since_update = np.append(self.time_since_update, 0)
+        self.state = np.append(self.state, TRACKER_STATES.STATE_TENTATIVE)
+        self.seq_result = np.append(self.seq_result, self.seq)
+        return len(self.trackers) - 1
+
+    def remove(self, index):
+        """
+        Stops following a target, the ones after it move one index down
+        """
+        self.trackers.pop(index).stop()
+        for name in ('mean', 'covariance', 'hits', 'age', 'time_since_update', 'state', 'seq_result'):
+            setattr(self, name, np.delete(getattr(self, name), index, axis=0))
+
+    def track(self, frame, timestamp=None):
+        """
+        :param timestamp: time.monotonic() the frame has been received at, now if None
+        :return: (N, 4) tlwh bboxes and (N,) states of the targets
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.dt = timestamp - self.timestamp if self.timestamp is not None else None
+        self.timestamp = timestamp
+
+        gap = timestamp - self.state_time
+        dt = self.kf.elapsed(gap)
+        self._predict(dt)
+        # A prediction is capped at MAX_DT. Past a longer gap the state is taken to be the frame's, rather than lag
+        # behind and catch up over the following frames
+        self.state_time = timestamp if gap >= self.kf.MAX_DT * FRAME_INTERVAL else self.state_time + dt
+
+        self.seq += 1
+        live = [tracker for tracker, state in zip(self.trackers, self.state) if state != TRACKER_STATES.STATE_DELETED]
+        if not self.process:  # One copy shared by the tracker threads, rather than one per target
+            frame = np.copy(frame)
+            frame.flags.writeable = False
+        for tracker in live:
+            tracker.submit(frame, self.seq, copy=self.process)
+
+        if not self.propogate:
+            for tracker in live:
+                tracker.wait_result(self.seq)
+
+        self._apply_tracker_results()
+        self._mark_missed()
+        self.latency = time.monotonic() - timestamp
+        return self._to_tlwh(), self.state.copy()
+
+    def predict_at(self, t):
+        """
+        See `TrackerPropagation.predict_at`
+        :return: (N, 4) tlwh bboxes predicted for `t`
+        """
+        if not len(self.trackers):
+            return self._to_tlwh()
+        mean, _ = self.kf.predict_batch(self.mean, self.covariance, t - self.state_time)
+        return self._to_tlwh(mean)
+
+    def stop(self):
+        for tracker in self.trackers:
+            tracker.stop()
+
+    def _apply_tracker_results(self):
+        results = [tracker.result for tracker in self.trackers]
+        seqs = np.array([seq for seq, _ in results], dtype=int)
+        rows = np.array([i for i, (seq, bbox) in enumerate(results) if seq > self.seq_result[i] and bbox is not None],
+                        dtype=int)
+        self.seq_result = np.maximum(self.seq_result, seqs)
+        if not len(rows):
+            return
+
+        measurements = self._to_xyah(np.array([results[i][1] for i in rows], dtype=np.float64))
+        distance = self.kf.gating_distance_batch(self.mean[rows], self.covariance[rows], measurements[:, None])[:, 0]
+        gated = distance < self.threshold
+        rows, measurements = rows[gated], measurements[gated]
+
+        self.mean[rows], self.covariance[rows] = self.kf.update_batch(self.mean[rows], self.covariance[rows],
+                                                                      measurements)
+        self.hits[rows] += 1
+        self.time_since_update[rows] = 0
+        confirmed = (self.state == TRACKER_STATES.STATE_TENTATIVE) & (self.hits >= self._n_init)
+        self.state[confirmed] = TRACKER_STATES.STATE_CONFIRMED
+
+    def _predict(self, dt):
+        if len(self.trackers):
+            self.mean, self.covariance = self.kf.predict_batch(self.mean, self.covariance, dt)
+        self.age += 1
+        self.time_since_update += 1
+
+    def _mark_missed(self):
+        deleted = (self.time_since_update > self._max_age) & (self.state != TRACKER_STATES.STATE_DELETED)
+        self.state[deleted] = TRACKER_STATES.STATE_DELETED
+        for i in np.flatnonzero(deleted):  # Kept rather than removed, so the indices of the other targets stay
+            self.trackers[i].stop()
+
+    @staticmethod
+    def _to_xyah(rect):
+        """
+        :param rect: tlwh, (4,) or (N, 4)
+        """
+        rect = np.array(rect, dtype=np.float64)
+        rect[..., :2] += rect[..., 2:] / 2
+        rect[..., 2] /= rect[..., 3]
+        return rect
+
+    def _to_tlwh(self, mean=None):
+        rect = (self.mean if mean is None else mean)[:, :4].copy()
+        rect[:, 2] *= rect[:, 3]
+        rect[:, :2] -= rect[:, 2:] / 2
+        return rect
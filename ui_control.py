@@ -5,7 +5,6 @@ from controller import AttackStrategyPixels, AttackStrategy, AttackStrategyAngle
 import threading
 import argparse
 from PID import PID
-from PyQt5.QtWidgets import QApplication
 import keyboard
 import cv2
 import sys
@@ -16,6 +15,7 @@ import csv
 from tracker_propagation import TRACKER_STATES
 import debug
 from args import getarparser
+from video_record import VideoRecorder
 
 from multiprocessing import Process, Pipe
 
@@ -57,15 +57,20 @@ class ParametersPidPixels:
 
 
 SETPOINT = 0  # The deviation should be "0"
+LINK_STATISTICS_PERIOD = 1.0  # Seconds between logging the link statistics
 SAMPLE_TIME = None  # "dt" gets updated manually
-N_FRAMES_SKIP = 50  # How many frames will be skipped (necessary for buffer purging)
 
 
 class UiControl:
 	def __init__(self):
 		self.controller = UiControl.__instantiate_controller()
+		self.controller.start_video_receiver()  # Keeps only the newest frame, so there is no backlog to purge
+		record_path = getarparser().parse_args().record
+		self.recorder = VideoRecorder(record_path) if record_path is not None else None
+		self.controller.record_video(self.recorder)
 		self.thread_rc_pid = UiControl.__instantiate_thread_rc(self.controller)
 		self.tracker = None
+		self.camera = None
 		self.__instantiate_key_mappings()
 
 		self.sem_engage_routine = threading.Semaphore(1)
@@ -79,7 +84,8 @@ class UiControl:
 
 	@staticmethod
 	def __instantiate_controller():
-		pid_input = getarparser().parse_args().pid_input
+		opts = getarparser().parse_args()
+		pid_input = opts.pid_input
 
 		pid_to_class_mapping = {
 			'pixels': (ParametersPidPixels, AttackStrategyPixels),
@@ -113,7 +119,8 @@ class UiControl:
 			delta_threshold_clean=delta_threshold_clean,
 			n_iterations_control_lag=n_iterations_control_lag,
 			control_horizontal_range=control_horizontal_range,
-			control_vertical_range=control_vertical_range)
+			control_vertical_range=control_vertical_range,
+			rc_rate=opts.rc_rate)
 
 	def __instantiate_key_mappings(self):
 		self.__map_rc_channel_toggle('w', 'pitch', 1.0)
@@ -130,6 +137,12 @@ class UiControl:
 		keyboard.add_hotkey('ctrl+a', self.controller.arm)
 		keyboard.add_hotkey('ctrl+d', self.controller.disarm)
 		keyboard.add_hotkey('ctrl+e', lambda: self.sem_engage_routine.release())
+		keyboard.add_hotkey('tab', self.__switch_target)
+
+	def __switch_target(self):
+		if self.camera is not None and self.camera.switch_target():
+			debug.FlightLog.add_log_event("switched to another target")
+			self.controller.reset_pid()  # The offsets of the other target do not continue the previous one's
 
 	def __map_rc_channel_toggle(self, kb_key, rc_channel, value, reset_on_release=True):
 		keyboard.add_hotkey(kb_key, self.controller.set_rc, args=(rc_channel, value,))
@@ -138,39 +151,89 @@ class UiControl:
 			# keyboard.add_hotkey(kb_key, self.controller.set_rc, args=(rc_channel, 0.0,), trigger_on_release=True)
 			keyboard.on_release_key(kb_key.split('+')[-1], lambda e: self.controller.set_rc(rc_channel, 0.0))
 
-	def engage_mode(self):
-		while True:
-			self.sem_engage_routine.acquire()
-			window_name = "Tracking"
+	@staticmethod
+	def __format_link_statistics(link_statistics):
+		def p50(name, factor=1.0):
+			value = link_statistics[name].get('p50')
+			return '-' if value is None else '%.1f' % (value * factor)
 
-			debug.FlightLog.add_log_event("engage mode")
+		rtt = link_statistics['command_rtt']
+		rtt = '-' if 'p50' not in rtt else '%.0f/%.0f/%.0f' % (rtt['p50'] * 1e3, rtt['p95'] * 1e3, rtt['p99'] * 1e3)
+		return f"rtt {rtt} ms, loss {p50('mavlink_loss', 100.0)} %, " \
+			f"video {p50('video_frame_rate')} fps {p50('video_throughput', 1e-6)} MB/s, " \
+			f"incomplete {p50('video_incomplete_frames')} /s"
 
-			camera = Camera(self.controller.get_raw_video_frame)
-			camera.purge_buffer(N_FRAMES_SKIP)
-			while not camera.init_tracker(window_name):
-				pass
-			# camera.purge_buffer(N_FRAMES_SKIP)
+	@staticmethod
+	def __offsets_predictor(camera, img, pid_input):
+		"""
+		:return: callable returning the offsets of the target predicted for a time.monotonic(), see
+		`AttackStrategy.on_target`
+		"""
+		def predict_offsets(t):
+			hv_positions = Camera.center_positions(camera.predict_at(t), img, type=pid_input, scale=camera.scale)
+			return hv_positions[0], -hv_positions[1]
 
-			while True:
+		return predict_offsets
 
-				# Visualize tracking
-				img = camera.get_frame()
-				if img is None:
-					continue
-				bbox, state = camera.track(img)
-				Camera.visualize_tracking(img, bbox, state, window_name)
-
-				# Process tracking state
-				if state == TRACKER_STATES.STATE_DELETED:
-					self.controller.on_target_lost()
-					debug.FlightLog.add_log_event("tracker lost")
-					cv2.waitKey(0)
-					cv2.destroyWindow(window_name)
-					break
-
-				# Calculate and apply control action
-				hv_positions = Camera.center_positions(bbox, img, type=getarparser().parse_args().pid_input)
-				self.controller.on_target(hv_positions[0], -hv_positions[1])
+	def engage_mode(self):
+		try:
+			while True:
+				self.sem_engage_routine.acquire()
+				window_name = "Tracking"
+
+				debug.FlightLog.add_log_event("engage mode")
+
+				opts = getarparser().parse_args()
+				camera = Camera(self.controller.get_video_frame, opts.decode_profile, opts.decode_workers)
+				while not camera.init_tracker(window_name):
+					pass
+				self.camera = camera
+
+				link_text = None
+				time_link_statistics = time.monotonic()
+				while True:
+
+					# Log link statistics, to tell link problems apart from processing ones
+					if time.monotonic() - time_link_statistics >= LINK_STATISTICS_PERIOD:
+						time_link_statistics = time.monotonic()
+						link_statistics = self.controller.get_link_statistics()
+						debug.FlightLog.add_log_link(link_statistics)
+						link_text = UiControl.__format_link_statistics(link_statistics)
+
+					# Visualize tracking
+					frame = camera.get_frame_record()
+					if frame is None:
+						continue
+					img = frame.img
+					bbox, state = camera.track(img, frame.timestamp)
+					if state == TRACKER_STATES.STATE_DELETED and camera.switch_target():
+						debug.FlightLog.add_log_event("tracker lost, switched to another target")
+						self.controller.reset_pid()  # The offsets of the other target do not continue the previous one's
+						bbox, state = camera.bboxes[camera.target], camera.states[camera.target]
+					Camera.visualize_tracking(img, bbox, state, window_name, camera.scale, link_text, camera.decoys())
+
+					# Process tracking state
+					if state == TRACKER_STATES.STATE_DELETED:
+						self.controller.on_target_lost()
+						debug.FlightLog.add_log_event("tracker lost")
+						cv2.waitKey(0)
+						cv2.destroyWindow(window_name)
+						self.camera = None
+						camera.close()
+						break
+
+					# Calculate and apply control action
+					hv_positions = Camera.center_positions(bbox, img, type=getarparser().parse_args().pid_input, scale=camera.scale)
+					predict_offsets = None
+					if opts.compensate_latency:
+						predict_offsets = UiControl.__offsets_predictor(camera, img, opts.pid_input)
+					self.controller.on_target(hv_positions[0], -hv_positions[1], frame.timestamp, predict_offsets)
+		finally:
+			if self.camera is not None:
+				self.camera.close()
+			if self.recorder is not None:
+				self.controller.record_video(None)
+				self.recorder.close()  # Flushes the queued frames, or the recording is left truncated
 
 
 if __name__ == "__main__":
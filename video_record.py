@@ -0,0 +1,229 @@
+"""
+Recording of the raw JPEG stream, and its replay.
+
+The container is a file header followed by segments. Each segment holds a header, an index entry per frame and the
+frames themselves. A segment is written in one go, so a recording interrupted by a crash loses the last segment only.
+
+    file header:     magic b'PVRC', version                    '<4sI'
+    segment header:  magic b'SEGM', number of frames, data size '<4sII'
+    index entry:     timestamp, file offset, length             '<dQI'
+    frame data
+
+    python3 video_record.py record flight.pvr --duration 60
+    python3 video_record.py replay flight.pvr --fast
+"""
+
+from pioneer_sdk import VideoFrame
+import argparse
+import mmap
+import queue
+import struct
+import threading
+import time
+
+
+FILE_HEADER = struct.Struct('<4sI')
+SEGMENT_HEADER = struct.Struct('<4sII')
+INDEX_ENTRY = struct.Struct('<dQI')
+FILE_MAGIC = b'PVRC'
+SEGMENT_MAGIC = b'SEGM'
+VERSION = 1
+
+
+class VideoRecorder:
+    """
+    Writes frames to a container file from a background thread, so recording never stalls the caller
+    """
+
+    def __init__(self, path, segment_frames=30, segment_duration=1.):
+        """
+        :param segment_frames: a segment gets written once it has this many frames ...
+        :param segment_duration: ... or spans this many seconds
+        """
+        self.path = path
+        self.segment_frames = segment_frames
+        self.segment_duration = segment_duration
+        self.n_frames = 0
+        self.__queue = queue.Queue()
+        self.__file = open(path, 'wb')
+        self.__file.write(FILE_HEADER.pack(FILE_MAGIC, VERSION))
+        self.__thread = threading.Thread(target=self.__write_task)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def record(self, frame):
+        """
+        :param frame: VideoFrame or JPEG frame. The data gets copied, so a memoryview may be reused afterwards
+        """
+        if not isinstance(frame, VideoFrame):
+            frame = VideoFrame(frame)
+        self.__queue.put((frame.timestamp, bytes(frame.data)))
+
+    def close(self):
+        """
+        Writes the frames which are still queued and closes the file
+        """
+        self.__queue.put(None)
+        self.__thread.join()
+        self.__file.close()
+
+    def __write_segment(self, frames):
+        index_size = SEGMENT_HEADER.size + INDEX_ENTRY.size * len(frames)
+        offset = self.__file.tell() + index_size
+        chunks = [SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(frames), sum(len(data) for _, data in frames))]
+        for timestamp, data in frames:
+            chunks.append(INDEX_ENTRY.pack(timestamp, offset, len(data)))
+            offset += len(data)
+        chunks.extend(data for _, data in frames)
+        self.__file.write(b''.join(chunks))
+        self.__file.flush()
+        self.n_frames += len(frames)
+
+    def __write_task(self):
+        frames = []
+        while True:
+            try:
+                timeout = self.segment_duration - (time.monotonic() - frames[0][0]) if frames else None
+                frame = self.__queue.get(timeout=max(timeout, 0) if timeout is not None else None)
+            except queue.Empty:
+                frame = ()
+            if frame:
+                frames.append(frame)
+            if frames and (frame is None or len(frames) >= self.segment_frames or
+                           time.monotonic() - frames[0][0] >= self.segment_duration):
+                self.__write_segment(frames)
+                frames = []
+            if frame is None:
+                break
+
+
+class VideoReplay:
+    """
+    Serves frames of a recording. The file is memory-mapped, frames are memoryviews into it
+    """
+
+    def __init__(self, path, realtime=True, loop=False):
+        """
+        :param realtime: serve frames at their original timing, as fast as requested otherwise
+        :param loop: start over once the recording is over
+        """
+        self.realtime = realtime
+        self.loop = loop
+        self.__file = open(path, 'rb')
+        self.__mmap = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__view = memoryview(self.__mmap)
+        self.index = self.__read_index()  # [(timestamp, offset, length)]
+        self.__position = 0
+        self.__time_origin = None
+
+    def __read_index(self):
+        magic, version = FILE_HEADER.unpack_from(self.__mmap, 0)
+        if magic != FILE_MAGIC or version != VERSION:
+            raise ValueError('not a video recording, or an unsupported version')
+
+        index = []
+        offset = FILE_HEADER.size
+        while offset + SEGMENT_HEADER.size <= len(self.__mmap):
+            magic, n_frames, data_size = SEGMENT_HEADER.unpack_from(self.__mmap, offset)
+            segment_end = offset + SEGMENT_HEADER.size + INDEX_ENTRY.size * n_frames + data_size
+            if magic != SEGMENT_MAGIC or segment_end > len(self.__mmap):  # Truncated by an interrupted recording
+                break
+            index.extend(INDEX_ENTRY.iter_unpack(
+                self.__view[offset + SEGMENT_HEADER.size:offset + SEGMENT_HEADER.size + INDEX_ENTRY.size * n_frames]))
+            offset = segment_end
+        return index
+
+    def __len__(self):
+        return len(self.index)
+
+    def frame(self, i):
+        """
+        :return: i-th frame as a memoryview
+        """
+        _, offset, length = self.index[i]
+        return self.__view[offset:offset + length]
+
+    def get_video_frame(self):
+        """
+        :return: VideoFrame, or None when the recording is over. Its timestamp is the time the frame was due at
+        when replaying at the original timing, and the current time otherwise
+        """
+        if self.__position >= len(self.index):
+            if not self.loop or not self.index:
+                return None
+            self.__position = 0
+            self.__time_origin = None
+
+        timestamp = time.monotonic()
+        if self.realtime:
+            if self.__time_origin is None:
+                self.__time_origin = timestamp - self.index[self.__position][0]
+            timestamp = self.__time_origin + self.index[self.__position][0]
+            delay = timestamp - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        self.__position += 1
+        return VideoFrame(self.frame(self.__position - 1), self.__position, timestamp)
+
+    def get_raw_video_frame(self):
+        frame = self.get_video_frame()
+        return frame.data if frame is not None else None
+
+    def close(self):
+        try:
+            self.__view.release()
+            self.__mmap.close()
+        except BufferError:  # A frame handed out is still referenced, the mapping goes away along with it
+            pass
+        self.__file.close()
+
+
+def getarparser():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_record = subparsers.add_parser('record', help='record the video stream of a Pioneer')
+    parser_record.add_argument('path', type=str)
+    parser_record.add_argument('--duration', type=float, default=60., help='seconds')
+    parser_replay = subparsers.add_parser('replay', help='decode a recording and report decode timing')
+    parser_replay.add_argument('path', type=str)
+    parser_replay.add_argument('--fast', action='store_true', help='do not keep the original timing')
+    parser_replay.add_argument('--show', action='store_true')
+    return parser
+
+
+if __name__ == '__main__':
+    opts = getarparser().parse_args()
+
+    if opts.command == 'record':
+        import pioneer_sdk
+
+        pioneer = pioneer_sdk.Pioneer(video_receiver_thread=True)
+        recorder = VideoRecorder(opts.path)
+        pioneer.record_video(recorder)
+        time.sleep(opts.duration)
+        pioneer.record_video(None)
+        recorder.close()
+        print('%d frames recorded' % recorder.n_frames)
+
+    elif opts.command == 'replay':
+        import cv2
+        from camera import Camera
+
+        replay = VideoReplay(opts.path, realtime=not opts.fast)
+        camera = Camera(replay.get_video_frame)
+        decode_durations = []
+        time_start = time.monotonic()
+        while True:
+            frame = camera.get_frame_record()
+            if frame is None:
+                break
+            decode_durations.append(frame.decode_duration)
+            if opts.show:
+                cv2.imshow('replay', frame.img)
+                cv2.waitKey(1)
+        elapsed = time.monotonic() - time_start
+        if decode_durations:
+            print('%d frames, %.1f fps, mean decode time %.3f ms' % (len(decode_durations),
+                                                                      len(decode_durations) / elapsed,
+                                                                      sum(decode_durations) / len(decode_durations) * 1e3))